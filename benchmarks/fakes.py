@@ -0,0 +1,138 @@
+"""
+    Заглушки объектов Discord для прогона настоящих когов без подключения к шлюзу.
+    Все сетевые методы сразу возвращают управление, поэтому в замеры попадает
+    только код бота и запросы к базе
+"""
+import itertools
+import discord
+
+from datetime import datetime, timezone
+
+_ids = itertools.count(10 ** 17)
+
+
+def next_id() -> int:
+    return next(_ids)
+
+
+class FakeAsset:
+    url = "https://cdn.discordapp.com/embed/avatars/0.png"
+
+
+class FakeRole:
+    def __init__(self, role_id: int):
+        self.id = role_id
+        self.color = discord.Colour.default()
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = "Benchmark guild"
+        self.roles: dict[int, FakeRole] = {}
+
+    def get_role(self, role_id: int):
+        return self.roles.setdefault(role_id, FakeRole(role_id))
+
+    @property
+    def default_role(self):
+        return self.get_role(self.id)
+
+
+class FakeMember:
+    def __init__(self, guild: FakeGuild, member_id: int = None, roles: list = (), bot: bool = False):
+        self.id = member_id or next_id()
+        self.guild = guild
+        self.roles = list(roles)
+        self.bot = bot
+        self.display_name = f"member-{self.id}"
+        self.mention = f"<@{self.id}>"
+        self.color = discord.Colour.default()
+        self.display_avatar = FakeAsset()
+
+    async def add_roles(self, *roles, reason=None):
+        self.roles.extend(roles)
+
+    async def send(self, *args, **kwargs):
+        return FakeMessage(self, None)
+
+
+class FakeMessage:
+    def __init__(self, author: FakeMember, channel, content: str = ""):
+        self.id = next_id()
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.jump_url = f"https://discord.com/channels/0/0/{self.id}"
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def edit(self, **kwargs):
+        return self
+
+    async def reply(self, *args, **kwargs):
+        return FakeMessage(self.author, self.channel)
+
+
+class FakeThread:
+    type = discord.ChannelType.public_thread
+
+    def __init__(self, guild: FakeGuild, parent_id: int, owner: FakeMember, bot_member: FakeMember):
+        self.id = next_id()
+        self.guild = guild
+        self.parent_id = parent_id
+        self.owner = owner
+        self.owner_id = owner.id
+        self.name = f"Вопрос {self.id}"
+        self.created_at = datetime.now(timezone.utc)
+        self.bot_member = bot_member
+        self.messages: list[FakeMessage] = []
+
+    async def send(self, *args, **kwargs):
+        message = FakeMessage(self.bot_member, self)
+        self.messages.append(message)
+        return message
+
+    async def edit(self, **kwargs):
+        self.name = kwargs.get("name", self.name)
+        return self
+
+    async def archive(self, locked: bool = False):
+        pass
+
+    def get_partial_message(self, message_id: int):
+        return FakeMessage(self.bot_member, self)
+
+    async def history(self, *, after=None, limit=None, oldest_first=None):
+        for message in self.messages[:limit]:
+            yield message
+
+
+class FakeResponse:
+    async def send_modal(self, modal):
+        pass
+
+    async def defer(self, *args, **kwargs):
+        pass
+
+
+class FakeContext:
+    "Заменяет и `discord.ApplicationContext`, и `discord.Interaction`"
+
+    def __init__(self, bot, author: FakeMember, channel=None):
+        self.bot = bot
+        self.client = bot
+        self.author = author
+        self.user = author
+        self.guild = author.guild
+        self.guild_id = author.guild.id
+        self.channel = channel
+        self.channel_id = channel.id if channel else None
+        self.response = FakeResponse()
+
+    async def defer(self, *args, **kwargs):
+        pass
+
+    async def respond(self, *args, **kwargs):
+        pass
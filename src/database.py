@@ -1,18 +1,34 @@
 import bisect
+import asyncio
+import hashlib
 import discord
 import tortoise
 import tortoise.fields
 
+from tortoise import Tortoise, connections
+from tortoise.exceptions import OperationalError
+from tortoise.utils import get_schema_sql
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
 from enum import IntEnum
-from datetime import datetime
-from typing import Optional
-from settings import BOT_IMPORTANT_MESSAGES_CHANNEL
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, AsyncIterator, Iterable, NamedTuple, Optional
+from settings import (MEMBER_SYNC_CHUNK_SIZE, USER_CACHE_SIZE, USER_CACHE_TTL, TICKET_CACHE_SIZE,
+                      BOT_MAIN_GUILD, HELP_FORUM_ID, BOT_MESSAGE_CHANNEL_ID,
+                      BOT_IMPORTANT_MESSAGES_CHANNEL, HELPER_ROLE_ID, CODE_REVIEW_ROLE,
+                      WELCOME_ROLE_ID, BOOSTY_LEVEL1_ROLE, BOOSTY_LEVEL2_ROLE,
+                      BOOSTY_LEVEL3_ROLE, BOOSTY_LEVEL4_ROLE, BOOSTY_EMOJI,
+                      REVIEW_EXPORT_BATCH_SIZE, BOOSTY_HELP_MULTIPLIER,
+                      REPUTATION_REBUILD_CHUNK_SIZE, SEARCH_COMMON_TERM_DOCS,
+                      USER_PURGE_CHUNK_SIZE, STATS_WINDOWS)
+from utils import LRUCache, BoostyIndex, TicketSearchIndex, split_message, tokenize
 
 
 class TicketStatus(IntEnum):
     created = 0
     burning = 1
     resolved = 2
+    archived = 3
 
 
 class TicketPriority(IntEnum):
@@ -20,57 +36,295 @@ class TicketPriority(IntEnum):
     golden = 1
 
 
+class LedgerEventKind(IntEnum):
+    ticket_created = 0
+    ticket_resolved = 1
+    rep_changed = 2
+    level_up = 3
+    member_left = 4
+
+
 class UserLevelChange(IntEnum):
     level_up = -1
     same = 0
     level_down = 1
 
 
+class UserStats(NamedTuple):
+    "Снимок статистики пользователя, который хранится в `user_stats_cache`"
+    helper_reputation: int
+    helper_level: int
+    asked_questions: int
+    resolved_questions: int
+
+    def rep_until_next_level(self) -> int:
+        return User.EXP_TO_LVLUP[self.helper_level] - self.helper_reputation
+
+
+class ReputationDiff(NamedTuple):
+    "Расхождение сохранённой репутации пользователя с пересчитанной по истории вопросов"
+    user_id: int
+    old_reputation: int
+    new_reputation: int
+    old_level: int
+    new_level: int
+    old_resolved: int
+    new_resolved: int
+
+
+class TicketInfo(NamedTuple):
+    "То, что нужно знать о вопросе для проверки и пометки решения"
+    id: int
+    status: TicketStatus
+    bounty: int
+    # Сообщение бота в начале ветки, к которому прикрепляется кнопка перехода к решению
+    starter_message_id: Optional[int]
+
+
+class GuildConfig(NamedTuple):
+    "Каналы и роли сервера, которые хранятся в `guild_configs`"
+    guild_id: int
+    help_forum_id: int
+    bot_message_channel_id: int
+    important_messages_channel_id: int
+    helper_role_id: int
+    code_review_role_id: Optional[int]
+    welcome_role_id: Optional[int]
+    boosty_level1_role_id: Optional[int]
+    boosty_level2_role_id: Optional[int]
+    boosty_level3_role_id: Optional[int]
+    boosty_level4_role_id: Optional[int]
+    boosty_emoji: str
+
+    @property
+    def boosty_roles(self) -> tuple[Optional[int], ...]:
+        "id ролей Boosty по возрастанию уровня подписки"
+        return (self.boosty_level1_role_id, self.boosty_level2_role_id,
+                self.boosty_level3_role_id, self.boosty_level4_role_id)
+
+
+class Leaderboard:
+    """
+        Таблицы лидеров серверов: помощники с ненулевой репутацией, заработанной
+        на вопросах сервера, упорядоченные по убыванию репутации.
+        Строятся один раз при запуске и обновляются при каждом решении вопроса.
+        Репутация вышедших участников хранится отдельно, пока они не вернутся
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._entries: dict[int, list[tuple[int, int]]] = {}  # guild_id -> [(-репутация, id)]
+        self._reputation: dict[int, dict[int, int]] = {}  # id -> {guild_id: репутация}
+        self._departed: dict[int, dict[int, int]] = {}
+        self._levels: dict[int, int] = {}  # id -> общий уровень помощника
+
+    def build(self, rows: Iterable[tuple[int, int, int, int, Optional[datetime]]]) -> None:
+        "Строит таблицы по строкам (guild_id, id, репутация на сервере, уровень, время выхода)"
+        self._entries, self._reputation, self._departed, self._levels = {}, {}, {}, {}
+        for guild_id, user_id, rep, level, left_at in rows:
+            if rep > 0:
+                (self._reputation if left_at is None else self._departed).setdefault(user_id, {})[guild_id] = rep
+                self._levels[user_id] = level
+        for user_id, guilds in self._reputation.items():
+            for guild_id, rep in guilds.items():
+                self._entries.setdefault(guild_id, []).append((-rep, user_id))
+        for entries in self._entries.values():
+            entries.sort()
+        self.ready = True
+
+    def _insert(self, guild_id: int, user_id: int, rep: int) -> None:
+        bisect.insort(self._entries.setdefault(guild_id, []), (-rep, user_id))
+
+    def _delete(self, guild_id: int, user_id: int, rep: int) -> None:
+        entries = self._entries[guild_id]
+        del entries[bisect.bisect_left(entries, (-rep, user_id))]
+
+    def hide(self, user_id: int) -> None:
+        guilds = self._reputation.pop(user_id, None)
+        if guilds is None:
+            return
+        for guild_id, rep in guilds.items():
+            self._delete(guild_id, user_id, rep)
+        self._departed[user_id] = guilds
+
+    def restore(self, user_id: int) -> None:
+        guilds = self._departed.pop(user_id, None)
+        if guilds is None:
+            return
+        for guild_id, rep in guilds.items():
+            self._insert(guild_id, user_id, rep)
+        self._reputation[user_id] = guilds
+
+    def remove(self, user_id: int) -> None:
+        self.hide(user_id)
+        self._departed.pop(user_id, None)
+        self._levels.pop(user_id, None)
+
+    def add(self, guild_id: int, user_id: int, amount: int, level: int) -> None:
+        "Добавляет репутацию, заработанную на вопросе сервера `guild_id`. `level` - новый общий уровень"
+        self._levels[user_id] = level
+        if user_id in self._departed:
+            departed = self._departed[user_id]
+            departed[guild_id] = departed.get(guild_id, 0) + amount
+            return
+
+        guilds = self._reputation.setdefault(user_id, {})
+        old_rep = guilds.pop(guild_id, 0)
+        if old_rep:
+            self._delete(guild_id, user_id, old_rep)
+        if old_rep + amount > 0:
+            guilds[guild_id] = old_rep + amount
+            self._insert(guild_id, user_id, old_rep + amount)
+        elif not guilds:
+            del self._reputation[user_id]
+            del self._levels[user_id]
+
+    def rank(self, guild_id: int, user_id: int) -> Optional[int]:
+        rep = self._reputation.get(user_id, {}).get(guild_id)
+        if rep is None:
+            return None
+        return bisect.bisect_left(self._entries[guild_id], (-rep, user_id)) + 1
+
+    def page(self, guild_id: int, offset: int, limit: int) -> list[tuple[int, int, int]]:
+        "Тройки (id, репутация на сервере, общий уровень)"
+        return [
+            (user_id, -rep, self._levels[user_id])
+            for rep, user_id in self._entries.get(guild_id, [])[offset:offset + limit]
+        ]
+
+    def count(self, guild_id: int) -> int:
+        return len(self._entries.get(guild_id, ()))
+
+
+# Кеш статистики пользователей. Обновляется при каждом сохранении и удалении `User`
+user_stats_cache = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# thread_id -> TicketInfo. Заполняется при создании вопроса и прогревается при запуске
+ticket_cache = LRUCache(maxsize=TICKET_CACHE_SIZE)
+leaderboard = Leaderboard()
+# guild_id -> GuildConfig. Загружается целиком при запуске и обновляется при сохранении `GuildSettings`
+guild_configs: dict[int, GuildConfig] = {}
+# Карта ролей Boosty обновляется вместе с `guild_configs`, уровни участников - в `BoostyCog`
+boosty_index = BoostyIndex()
+# Поиск похожих решённых вопросов без Postgres. Строится при запуске и дополняется при решении вопросов
+ticket_search_index = TicketSearchIndex()
+# Лексемы Postgres из более чем `SEARCH_COMMON_TERM_DOCS` решённых вопросов. Обновляются раз в `SEARCH_LEXEMES_REFRESH_HOURS`
+common_ticket_lexemes: list[str] = []
+# (guild_id, дней) -> {приоритет: (p50, p90)} для окон `STATS_WINDOWS`. Обновляются вместе со сводной статистикой
+ticket_resolution_times: dict[tuple[int, int], dict["TicketPriority", tuple[float, float]]] = {}
+
+
+def get_guild_config(guild_id: Optional[int]) -> Optional[GuildConfig]:
+    return guild_configs.get(guild_id)
+
+
+class GuildSettings(tortoise.Model):
+    guild_id = tortoise.fields.BigIntField(primary_key=True)
+    help_forum_id = tortoise.fields.BigIntField()
+    bot_message_channel_id = tortoise.fields.BigIntField()
+    important_messages_channel_id = tortoise.fields.BigIntField()
+    helper_role_id = tortoise.fields.BigIntField()
+    code_review_role_id = tortoise.fields.BigIntField(null=True)
+    welcome_role_id = tortoise.fields.BigIntField(null=True)
+    boosty_level1_role_id = tortoise.fields.BigIntField(null=True)
+    boosty_level2_role_id = tortoise.fields.BigIntField(null=True)
+    boosty_level3_role_id = tortoise.fields.BigIntField(null=True)
+    boosty_level4_role_id = tortoise.fields.BigIntField(null=True)
+    boosty_emoji = tortoise.fields.CharField(max_length=64, default="")
+
+    @property
+    def config(self) -> GuildConfig:
+        return GuildConfig(*(getattr(self, field) for field in GuildConfig._fields))
+
+    async def save(self, using_db=None, update_fields: Optional[Iterable[str]] = None,
+                   force_create: bool = False, force_update: bool = False) -> None:
+        await super().save(using_db=using_db, update_fields=update_fields,
+                           force_create=force_create, force_update=force_update)
+        if not self._partial:
+            self._cache()
+
+    async def delete(self, using_db=None) -> None:
+        await super().delete(using_db=using_db)
+        guild_configs.pop(self.guild_id, None)
+        boosty_index.set_guild_roles(self.guild_id, ())
+
+    def _cache(self) -> None:
+        guild_configs[self.guild_id] = self.config
+        boosty_index.set_guild_roles(self.guild_id, self.config.boosty_roles)
+
+    @classmethod
+    async def load_all(cls):
+        "Загружает настройки всех серверов одним запросом. Основной сервер создаётся из `settings.py`"
+        await cls.get_or_create(guild_id=BOT_MAIN_GUILD, defaults={
+            "help_forum_id": HELP_FORUM_ID,
+            "bot_message_channel_id": BOT_MESSAGE_CHANNEL_ID,
+            "important_messages_channel_id": BOT_IMPORTANT_MESSAGES_CHANNEL,
+            "helper_role_id": HELPER_ROLE_ID,
+            "code_review_role_id": CODE_REVIEW_ROLE,
+            "welcome_role_id": WELCOME_ROLE_ID,
+            "boosty_level1_role_id": BOOSTY_LEVEL1_ROLE,
+            "boosty_level2_role_id": BOOSTY_LEVEL2_ROLE,
+            "boosty_level3_role_id": BOOSTY_LEVEL3_ROLE,
+            "boosty_level4_role_id": BOOSTY_LEVEL4_ROLE,
+            "boosty_emoji": BOOSTY_EMOJI,
+        })
+
+        guild_configs.clear()
+        for guild in await cls.all():
+            guild._cache()
+
+
 class Review(tortoise.Model):
     id = tortoise.fields.IntField(primary_key=True)
     started_at = tortoise.fields.DatetimeField(auto_now_add=True)
     closed_at = tortoise.fields.DatetimeField()
     message_id = tortoise.fields.BigIntField()
+    guild_id = tortoise.fields.BigIntField(default=BOT_MAIN_GUILD)
+    # Сколько сообщений о завершении сбора заявок уже отправлено, чтобы повтор `close` их не дублировал
+    close_messages_sent = tortoise.fields.IntField(default=0)
+    # Канал сообщения о сборе заявок. Настройки сервера могут измениться до закрытия ревью
+    channel_id = tortoise.fields.BigIntField(null=True)
 
     @classmethod
-    def get_active_or_none(cls, **kwargs):
+    def filter_active(cls, **kwargs):
         current_time = datetime.now()
-        return cls.get_or_none(started_at__lte=current_time, closed_at__gte=current_time, **kwargs)
+        return cls.filter(started_at__lte=current_time, closed_at__gte=current_time, **kwargs)
+
+    @classmethod
+    def get_active_or_none(cls, **kwargs):
+        return cls.filter_active(**kwargs).first()
 
     @classmethod
-    async def check_if_user_present(cls, discord_id: int) -> Optional[bool]:
+    async def check_if_user_present(cls, discord_id: int, review_id: Optional[int] = None) -> Optional[bool]:
         """
             Проверяет, записан ли пользователь на код-ревью или нет.
             Возвращает `None` если нет сбора заявок или `bool`, обозначающий
             наличие заявки от пользователя, в противном случае
         """
-        review = await cls.get_active_or_none().prefetch_related("entries")
-        if not review:
-            return None
-        
-        for entr in review.entries:
-            if entr.discord_id == discord_id:
-                return True
-        
-        return False
+        if review_id is None:
+            review = await cls.get_active_or_none().only("id")
+            if not review:
+                return None
+            review_id = review.id
+
+        return await ReviewEntry.filter(review_id=review_id, discord_id=discord_id).exists()
 
     @classmethod
-    async def delete_entry_if_present(cls, discord_id: int) -> Optional[bool]:
+    async def delete_entry_if_present(cls, discord_id: int, review_id: Optional[int] = None) -> Optional[bool]:
         """
             Удаляет запись участника на код-ревью по `discord_id`.
             Возвращает `None` если нет сбора заявок. Иначе `bool` - статус операции
         """
-        review = await cls.get_active_or_none().prefetch_related("entries")
+        if review_id is None:
+            review = await cls.get_active_or_none().only("id")
+            if not review:
+                return None
+            review_id = review.id
 
-        if not review:
-            return None
-
-        for entry in review.entries:
-            if entry.discord_id == discord_id:
-                await entry.delete()
-                return True
+        deleted = await ReviewEntry.filter(review_id=review_id, discord_id=discord_id).delete()
+        return deleted > 0
 
-        return False
+    async def get_participant_ids(self) -> set[int]:
+        return set(await ReviewEntry.filter(review_id=self.id).values_list("discord_id", flat=True))
 
     @property
     def seconds_until_finished(self):
@@ -78,28 +332,61 @@ class Review(tortoise.Model):
         return max((self.closed_at - current_time).total_seconds(), 0)
     
     async def close(self, bot: discord.Bot):
-        participants = await self.entries.all()
-        channel = (
-            bot.get_channel(BOT_IMPORTANT_MESSAGES_CHANNEL) or
-            await bot.fetch_channel(BOT_IMPORTANT_MESSAGES_CHANNEL)
-        )
+        """
+            Убирает кнопки у сообщения о сборе заявок и отправляет итоги в его канал.
+            Без настроек сервера или доступа к каналу ревью закрывается молча:
+            повтор задачи этого не исправит
+        """
+        channel_id = self.channel_id
+        if channel_id is None:
+            # Ревью, запущенные до сохранения канала
+            config = get_guild_config(self.guild_id)
+            channel_id = config.important_messages_channel_id if config else None
+        if channel_id is None:
+            return print(f"Review #{self.id} closed without summary: guild {self.guild_id} is not configured")
 
-        message = await channel.fetch_message(self.message_id)
-        await message.edit(view=None)
+        try:
+            channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+        except (discord.NotFound, discord.Forbidden) as e:
+            return print(f"Review #{self.id} closed without summary: channel {channel_id} is unavailable ({e})")
+        try:
+            message = await channel.fetch_message(self.message_id)
+        except discord.NotFound:
+            # Сообщение удалили: итоги всё равно отправляются в канал
+            message = None
+        if message is not None:
+            await message.edit(view=None)
+
+        participants = await self.entries.all().order_by("id")
         if participants:
-            users_string = "\n".join(f"<@{user.discord_id}>" for user in participants)
-            await message.reply(
-                content=(
-                    "## Приём заявок на код-ревью завершён!\n"
-                    "📃Список участвующих:\n"
-                    f'{users_string}\n'
-                    "В этот канал скоро придёт информация со временем начала стрима =)"
-                )
-            )
+            parts = split_message([
+                "## Приём заявок на код-ревью завершён!",
+                "📃Список участвующих:",
+                *(f"<@{user.discord_id}>" for user in participants),
+                "В этот канал скоро придёт информация со временем начала стрима =)",
+            ])
         else:
-            await message.reply(
-                "Код-ревью отменено, так как никто на него не записался. Очень жаль 😢"
-            )
+            parts = ["Код-ревью отменено, так как никто на него не записался. Очень жаль 😢"]
+
+        # Первая часть - ответ на сообщение о сборе заявок, остальные идут следом в канал
+        for index in range(self.close_messages_sent, len(parts)):
+            try:
+                if index == 0 and message is not None:
+                    await message.reply(content=parts[index])
+                else:
+                    await channel.send(parts[index])
+            except discord.Forbidden as e:
+                return print(f"Review #{self.id} closed without summary: no access to channel {channel_id} ({e})")
+            self.close_messages_sent = index + 1
+            await self.save(update_fields=["close_messages_sent"])
+
+
+class ScheduledJob(tortoise.Model):
+    id = tortoise.fields.IntField(primary_key=True)
+    kind = tortoise.fields.CharField(max_length=50)
+    run_at = tortoise.fields.DatetimeField(db_index=True)
+    payload = tortoise.fields.JSONField(default=dict)
+    attempts = tortoise.fields.IntField(default=0)
 
 
 class ReviewEntry(tortoise.Model):
@@ -111,19 +398,59 @@ class ReviewEntry(tortoise.Model):
     architecture_image_url = tortoise.fields.CharField(max_length=100, null=True)
     check_modules = tortoise.fields.CharField(max_length=200)
 
+    class Meta:
+        unique_together = (("review", "discord_id"),)
+
+    EXPORT_FIELDS = ("id", "discord_id", "github_url", "description",
+                     "check_modules", "architecture_image_url")
+
+    @classmethod
+    async def stream(cls, review_id: int,
+                     batch_size: int = REVIEW_EXPORT_BATCH_SIZE) -> AsyncIterator[dict[str, Any]]:
+        """
+            Отдаёт заявки на ревью по одной, не загружая их все в память.
+            В Postgres используется серверный курсор, в остальных базах - постраничная
+            выборка по первичному ключу
+        """
+        connection = connections.get("default")
+        if connection.capabilities.dialect == "postgres":
+            columns = ", ".join(f'"{field}"' for field in cls.EXPORT_FIELDS)
+            query = f'SELECT {columns} FROM "reviewentry" WHERE "review_id" = $1 ORDER BY "id"'
+            async with connection.acquire_connection() as raw_connection:
+                async with raw_connection.transaction():
+                    async for record in raw_connection.cursor(query, review_id, prefetch=batch_size):
+                        yield dict(record)
+            return
+
+        last_id = 0
+        while True:
+            rows = await (cls
+                          .filter(review_id=review_id, id__gt=last_id)
+                          .order_by("id")
+                          .limit(batch_size)
+                          .values(*cls.EXPORT_FIELDS))
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]["id"]
+
 
 class User(tortoise.Model):
     EXP_TO_LVLUP = [5, 25, 50, 100, 175, 250, 500, 1000, 2500]
 
     id = tortoise.fields.BigIntField(primary_key=True)
-    helper_reputation = tortoise.fields.IntField(default=0)
+    helper_reputation = tortoise.fields.IntField(default=0, db_index=True)
     helper_level = tortoise.fields.IntField(default=0)
     asked_questions = tortoise.fields.IntField(default=0)
     resolved_questions = tortoise.fields.IntField(default=0)
+    # Когда участник вышел со всех серверов. Такие пользователи не видны в таблице лидеров,
+    # восстанавливаются при возвращении и удаляются через `USER_RETENTION_DAYS` дней
+    left_at = tortoise.fields.DatetimeField(null=True)
 
     async def change_rep(self, amount: int) -> tuple[UserLevelChange, int]:
         new_rep = self.helper_reputation + amount
-        new_level = bisect.bisect_right(self.EXP_TO_LVLUP, new_rep)
+        new_level = self.level_for_reputation(new_rep)
         old_level = self.helper_level
 
         self.helper_reputation = new_rep
@@ -140,6 +467,285 @@ class User(tortoise.Model):
         to_add = amount - self.helper_reputation
         return await self.change_rep(to_add)
     
+    @classmethod
+    def level_for_reputation(cls, reputation: int) -> int:
+        return bisect.bisect_right(cls.EXP_TO_LVLUP, reputation)
+
+    @property
+    def stats(self) -> UserStats:
+        return UserStats(*(getattr(self, field) for field in UserStats._fields))
+
+    @classmethod
+    async def get_stats(cls, user_id: int) -> Optional[UserStats]:
+        "Возвращает статистику пользователя из кеша, а при промахе загружает её из базы"
+        stats = user_stats_cache.get(user_id)
+        if stats is not None:
+            return stats
+
+        user = await cls.get_or_none(id=user_id).only(*UserStats._fields)
+        if not user:
+            return None
+
+        user_stats_cache.set(user_id, user.stats)
+        return user.stats
+
+    def _write_through(self, update_fields: Optional[Iterable[str]]) -> None:
+        if update_fields is None and not self._partial:
+            user_stats_cache.set(self.id, self.stats)
+            return
+
+        cached = user_stats_cache.peek(self.id)
+        if cached is None:
+            return
+
+        changed = {
+            field: getattr(self, field)
+            for field in (update_fields or ())
+            if field in UserStats._fields
+        }
+        user_stats_cache.set(self.id, cached._replace(**changed))
+
+    async def save(self, using_db=None, update_fields: Optional[Iterable[str]] = None,
+                   force_create: bool = False, force_update: bool = False) -> None:
+        await super().save(using_db=using_db, update_fields=update_fields,
+                           force_create=force_create, force_update=force_update)
+        self._write_through(update_fields)
+
+    async def delete(self, using_db=None) -> None:
+        await super().delete(using_db=using_db)
+        user_stats_cache.pop(self.id)
+        leaderboard.remove(self.id)
+
+    @classmethod
+    def _guild_reputation_sql(cls, guild_id: Optional[int] = None) -> str:
+        """
+            Подзапрос (guild_id, id, reputation, helper_level, left_at): репутация, заработанная
+            помощниками на вопросах каждого сервера, по тем же правилам, что и `_earned_sql`
+        """
+        return f"""
+            SELECT "e"."guild_id", "e"."id", "e"."reputation", "user"."helper_level", "user"."left_at"
+            FROM (
+                SELECT "guild_id", "helper_id" AS "id", SUM("bounty") AS "reputation"
+                FROM "ticket"
+                WHERE "status" = {TicketStatus.resolved.value}
+                      AND "helper_id" IS DISTINCT FROM "owner_id"
+                      {f'AND "guild_id" = {int(guild_id)}' if guild_id is not None else ""}
+                GROUP BY "guild_id", "helper_id"
+            ) AS "e"
+            JOIN "user" ON "user"."id" = "e"."id"
+            WHERE "e"."reputation" > 0
+        """
+
+    @classmethod
+    async def build_leaderboard(cls):
+        "Строит таблицы лидеров всех серверов одним запросом по решённым вопросам"
+        rows = await connections.get("default").execute_query_dict(cls._guild_reputation_sql())
+        leaderboard.build(
+            (row["guild_id"], row["id"], row["reputation"], row["helper_level"], row["left_at"])
+            for row in rows
+        )
+
+    @classmethod
+    async def _guild_ranking(cls, guild_id: int, columns: str = '"id", "reputation", "helper_level"',
+                             where: str = "", tail: str = "") -> list[dict]:
+        "Запрос к таблице лидеров сервера в базе, пока `leaderboard` не построен"
+        return await connections.get("default").execute_query_dict(f"""
+            SELECT {columns} FROM ({cls._guild_reputation_sql(guild_id)}) AS "ranking"
+            WHERE "left_at" IS NULL {where}
+            {tail}
+        """)
+
+    @classmethod
+    async def get_leaderboard_page(cls, guild_id: int, offset: int, limit: int) -> list[tuple[int, int, int]]:
+        "Возвращает тройки (id, репутация на сервере, общий уровень) начиная с позиции `offset`"
+        if leaderboard.ready:
+            return leaderboard.page(guild_id, offset, limit)
+
+        rows = await cls._guild_ranking(
+            guild_id, tail=f'ORDER BY "reputation" DESC, "id" LIMIT {int(limit)} OFFSET {int(offset)}'
+        )
+        return [(row["id"], row["reputation"], row["helper_level"]) for row in rows]
+
+    @classmethod
+    async def get_rank(cls, guild_id: int, user_id: int) -> Optional[int]:
+        "Место пользователя в таблице лидеров сервера или `None`, если у него нет репутации на сервере"
+        if leaderboard.ready:
+            return leaderboard.rank(guild_id, user_id)
+
+        rows = await cls._guild_ranking(guild_id, where=f'AND "id" = {int(user_id)}')
+        if not rows:
+            return None
+
+        rep = int(rows[0]["reputation"])
+        above = await cls._guild_ranking(
+            guild_id, columns='COUNT(*) AS "count"',
+            where=f'AND ("reputation" > {rep} OR "reputation" = {rep} AND "id" < {int(user_id)})',
+        )
+        return above[0]["count"] + 1
+
+    @classmethod
+    async def count_helpers(cls, guild_id: int) -> int:
+        if leaderboard.ready:
+            return leaderboard.count(guild_id)
+        rows = await cls._guild_ranking(guild_id, columns='COUNT(*) AS "count"')
+        return rows[0]["count"]
+
+    @classmethod
+    async def register_missing(cls, ids: Iterable[int]) -> int:
+        """
+            Создаёт недостающих пользователей одним INSERT ... ON CONFLICT DO UPDATE.
+            Тот же запрос снимает отметку о выходе с вернувшихся участников
+        """
+        users = [cls(id=user_id) for user_id in ids]
+        if users:
+            await cls.bulk_create(users, batch_size=MEMBER_SYNC_CHUNK_SIZE,
+                                  on_conflict=["id"], update_fields=["left_at"])
+            for user in users:
+                leaderboard.restore(user.id)
+        return len(users)
+
+    @classmethod
+    async def mark_left(cls, ids: Iterable[int]) -> int:
+        "Отмечает выход пользователей со всех серверов, не удаляя их данные"
+        ids = list(ids)
+        left_at = datetime.now().astimezone()
+        marked = 0
+        for start in range(0, len(ids), MEMBER_SYNC_CHUNK_SIZE):
+            marked += await cls.filter(
+                id__in=ids[start:start + MEMBER_SYNC_CHUNK_SIZE], left_at__isnull=True
+            ).update(left_at=left_at)
+        for user_id in ids:
+            leaderboard.hide(user_id)
+        return marked
+
+    @classmethod
+    async def purge_departed(cls, before: datetime, chunk_size: int = USER_PURGE_CHUNK_SIZE) -> int:
+        """
+            Удаляет пользователей, вышедших раньше `before`, пачками по `chunk_size`.
+            Вопросы остаются в базе без автора или помощника (ON DELETE SET NULL),
+            поэтому заработанная на них репутация других помощников не теряется
+        """
+        purged = 0
+        last_id = 0
+        while True:
+            ids = await (cls
+                         .filter(left_at__lt=before, id__gt=last_id)
+                         .order_by("id")
+                         .limit(chunk_size)
+                         .values_list("id", flat=True))
+            if not ids:
+                return purged
+            last_id = ids[-1]
+
+            # Вернувшиеся между запросами участники уже без отметки и не удаляются
+            purged += await cls.filter(id__in=ids, left_at__lt=before).delete()
+            for user_id in ids:
+                user_stats_cache.pop(user_id)
+                leaderboard.remove(user_id)
+
+    @classmethod
+    async def sync_with_members(cls, member_ids: AsyncIterator[int]) -> tuple[int, set[int]]:
+        """
+            Синхронизирует таблицу пользователей со списком участников серверов.
+            Существующие id загружаются одним запросом, недостающие добавляются
+            пачками по `MEMBER_SYNC_CHUNK_SIZE`. Возвращает количество добавленных
+            строк и id пользователей, которых больше нет ни на одном сервере.
+            Вышедшие участники, которые снова есть на сервере, восстанавливаются
+        """
+        known_ids = set(await cls.filter(left_at__isnull=True).values_list("id", flat=True))
+        seen_ids = set()
+        missing_ids = []
+        added = 0
+
+        async for member_id in member_ids:
+            # Один и тот же участник может состоять в нескольких серверах
+            if member_id in seen_ids:
+                continue
+            seen_ids.add(member_id)
+            if member_id in known_ids:
+                continue
+
+            missing_ids.append(member_id)
+            if len(missing_ids) >= MEMBER_SYNC_CHUNK_SIZE:
+                added += await cls.register_missing(missing_ids)
+                missing_ids.clear()
+
+        added += await cls.register_missing(missing_ids)
+        return added, known_ids - seen_ids
+
+    @classmethod
+    def _level_sql(cls, reputation: str) -> str:
+        "Выражение SQL, которое считает уровень по репутации так же, как `level_for_reputation`"
+        return " + ".join(
+            f"(CASE WHEN {reputation} >= {threshold} THEN 1 ELSE 0 END)" for threshold in cls.EXP_TO_LVLUP
+        )
+
+    @classmethod
+    def _earned_sql(cls, user_filter: str = "") -> str:
+        """
+            Подзапрос (id, reputation, resolved) по решённым вопросам пользователей.
+            Ответы на свои же вопросы репутацию не дают, а вопросы удалённых авторов дают
+        """
+        return f"""
+            SELECT "u"."id", COALESCE("e"."reputation", 0) AS "reputation",
+                   COALESCE("e"."resolved", 0) AS "resolved"
+            FROM "user" AS "u"
+            LEFT JOIN (
+                SELECT "helper_id", SUM("bounty") AS "reputation", COUNT(*) AS "resolved"
+                FROM "ticket"
+                WHERE "status" = {TicketStatus.resolved.value}
+                      AND "helper_id" IS DISTINCT FROM "owner_id"
+                      {f'AND "helper_id" IN ({user_filter})' if user_filter else ""}
+                GROUP BY "helper_id"
+            ) AS "e" ON "e"."helper_id" = "u"."id"
+            {f'WHERE "u"."id" IN ({user_filter})' if user_filter else ""}
+        """
+
+    @classmethod
+    async def find_reputation_drift(cls) -> list[ReputationDiff]:
+        "Пересчитывает репутацию, уровень и число решённых вопросов всех пользователей одним запросом"
+        query = f"""
+            SELECT "user"."id" AS "user_id",
+                   "helper_reputation" AS "old_reputation", "reputation" AS "new_reputation",
+                   "helper_level" AS "old_level", {cls._level_sql('"reputation"')} AS "new_level",
+                   "resolved_questions" AS "old_resolved", "resolved" AS "new_resolved"
+            FROM "user"
+            JOIN ({cls._earned_sql()}) AS "earned" ON "earned"."id" = "user"."id"
+            WHERE "helper_reputation" <> "reputation"
+               OR "resolved_questions" <> "resolved"
+               OR "helper_level" <> {cls._level_sql('"reputation"')}
+            ORDER BY "user"."id"
+        """
+        rows = await connections.get("default").execute_query_dict(query)
+        return [ReputationDiff(**row) for row in rows]
+
+    @classmethod
+    async def apply_reputation_rebuild(cls, user_ids: list[int],
+                                       chunk_size: int = REPUTATION_REBUILD_CHUNK_SIZE):
+        """
+            Записывает пересчитанные значения пачками по `chunk_size` пользователей.
+            Каждая пачка снова считается по вопросам в самом UPDATE, поэтому решения,
+            отмеченные во время пересчёта, не теряются. Между пачками управление
+            возвращается циклу событий
+        """
+        for start in range(0, len(user_ids), chunk_size):
+            chunk_ids = user_ids[start:start + chunk_size]
+            chunk = ", ".join(str(int(user_id)) for user_id in chunk_ids)
+            await connections.get("default").execute_script(f"""
+                UPDATE "user" SET
+                    "helper_reputation" = "earned"."reputation",
+                    "resolved_questions" = "earned"."resolved",
+                    "helper_level" = {cls._level_sql('"earned"."reputation"')}
+                FROM ({cls._earned_sql(chunk)}) AS "earned"
+                WHERE "user"."id" = "earned"."id"
+            """)
+
+            for user_id in chunk_ids:
+                user_stats_cache.pop(user_id)
+            await asyncio.sleep(0)
+
+        await cls.build_leaderboard()
+
     def rep_until_next_level(self) -> int:
         required_rep = self.EXP_TO_LVLUP[self.helper_level]
         remaining_rep = required_rep - self.helper_reputation
@@ -151,23 +757,492 @@ class User(tortoise.Model):
 
 class Ticket(tortoise.Model):
     id = tortoise.fields.IntField(primary_key=True)
+    # Вопросы переживают удаление пользователей в `User.purge_departed`
     owner = tortoise.fields.ForeignKeyField("discord.User",
-                                            related_name="created_tickets")
+                                            related_name="created_tickets",
+                                            null=True, on_delete=tortoise.fields.SET_NULL,
+                                            db_index=True)
     helper = tortoise.fields.ForeignKeyField("discord.User",
                                              related_name="resolved_tickets",
-                                             null=True)
+                                             null=True, on_delete=tortoise.fields.SET_NULL,
+                                             db_index=True)
     bounty = tortoise.fields.IntField(default=5)
     thread_id = tortoise.fields.BigIntField(unique=True)
     status = tortoise.fields.IntEnumField(TicketStatus, default=TicketStatus.created)
     priority = tortoise.fields.IntEnumField(TicketPriority, default=TicketPriority.regular)
     created_at = tortoise.fields.DatetimeField(auto_now_add=True)
     resolved_at = tortoise.fields.DatetimeField(null=True)
+    starter_message_id = tortoise.fields.BigIntField(null=True)
+    guild_id = tortoise.fields.BigIntField(default=BOT_MAIN_GUILD)
+    # Название ветки и текст решения для поиска похожих вопросов.
+    # В Postgres по ним строится колонка "search_vector" с GIN-индексом (см. `POSTGRES_MIGRATIONS`)
+    title = tortoise.fields.CharField(max_length=100, null=True)
+    solution_text = tortoise.fields.TextField(null=True)
+
+    class Meta:
+        indexes = (("status", "created_at"),)
+
+    # Кандидатов ищем только по редким словам вопроса, а сортируем по всем словам,
+    # как `TicketSearchIndex.search`
+    SEARCH_QUERY = f"""
+        SELECT "thread_id", "title"
+        FROM "ticket", (
+            SELECT array_to_string(array_agg(quote_literal("lexeme"))
+                                   FILTER (WHERE "lexeme" <> ALL($4::text[])), ' | ')::tsquery AS "rare",
+                   array_to_string(array_agg(quote_literal("lexeme")), ' | ')::tsquery AS "full"
+            FROM unnest(tsvector_to_array(to_tsvector('russian', $1))) AS "lexeme"
+        ) AS "query"
+        WHERE "status" = {TicketStatus.resolved.value} AND "guild_id" = $2
+              AND "search_vector" @@ "query"."rare"
+        ORDER BY ts_rank("search_vector", "query"."full") DESC
+        LIMIT $3
+    """
+    COMMON_LEXEMES_QUERY = f"""
+        SELECT "word" FROM ts_stat(
+            'SELECT "search_vector" FROM "ticket" WHERE "status" = {TicketStatus.resolved.value}'
+        )
+        WHERE "ndoc" > $1
+    """
+
+    @property
+    def info(self) -> TicketInfo:
+        return TicketInfo(self.id, TicketStatus(self.status), self.bounty, self.starter_message_id)
+
+    async def save(self, using_db=None, update_fields: Optional[Iterable[str]] = None,
+                   force_create: bool = False, force_update: bool = False) -> None:
+        await super().save(using_db=using_db, update_fields=update_fields,
+                           force_create=force_create, force_update=force_update)
+        if not self._partial:
+            ticket_cache.set(self.thread_id, self.info)
+
+    @classmethod
+    async def get_info(cls, thread_id: int) -> Optional[TicketInfo]:
+        "Возвращает краткую информацию о вопросе из кеша, а при промахе загружает её из базы"
+        info = ticket_cache.get(thread_id)
+        if info is not None:
+            return info
+
+        ticket = await cls.get_or_none(thread_id=thread_id).only(
+            "id", "thread_id", "status", "bounty", "starter_message_id"
+        )
+        if not ticket:
+            return None
+
+        ticket_cache.set(thread_id, ticket.info)
+        return ticket.info
+
+    @classmethod
+    async def set_starter_message(cls, thread_id: int, message_id: int):
+        await cls.filter(thread_id=thread_id).update(starter_message_id=message_id)
+        cached = ticket_cache.peek(thread_id)
+        if cached is not None:
+            ticket_cache.set(thread_id, cached._replace(starter_message_id=message_id))
+
+    @classmethod
+    async def without_starter_message(cls, limit: int) -> list[int]:
+        "id веток нерешённых вопросов, созданных до того, как бот начал запоминать стартовое сообщение"
+        return await (cls
+                      .filter(status__in=[TicketStatus.created, TicketStatus.burning],
+                              starter_message_id=None)
+                      .order_by("id")
+                      .limit(limit)
+                      .values_list("thread_id", flat=True))
+
+    @classmethod
+    async def resolve(cls, thread_id: int, helper_id: int,
+                      solution_text: Optional[str] = None) -> Optional[TicketInfo]:
+        """
+            Помечает вопрос решённым одним UPDATE и запоминает текст решения.
+            Возвращает `None`, если вопроса нет или он уже был решён
+        """
+        info = await cls.get_info(thread_id)
+        if not info or info.status == TicketStatus.resolved:
+            return None
+
+        updated = await (cls
+                         .filter(id=info.id)
+                         .exclude(status=TicketStatus.resolved)
+                         .update(resolved_at=datetime.now().astimezone(),
+                                 status=TicketStatus.resolved,
+                                 helper_id=helper_id,
+                                 solution_text=solution_text))
+
+        info = info._replace(status=TicketStatus.resolved)
+        ticket_cache.set(thread_id, info)
+        if not updated:
+            return None
+
+        if not cls._has_fulltext_search():
+            guild_id, title = await cls.get(id=info.id).values_list("guild_id", "title")
+            ticket_search_index.add(guild_id, thread_id, title, solution_text)
+        return info
+
+    @staticmethod
+    def _has_fulltext_search() -> bool:
+        return connections.get("default").capabilities.dialect == "postgres"
+
+    @classmethod
+    async def find_similar(cls, guild_id: int, text: str, limit: int) -> list[tuple[int, str]]:
+        """
+            До `limit` решённых вопросов сервера, похожих на `text`, по убыванию похожести.
+            Совпадать должно хотя бы одно слово. Возвращает пары (thread_id, название)
+        """
+        words = tokenize(text)
+        if not words:
+            return []
+
+        if not cls._has_fulltext_search():
+            return ticket_search_index.search(guild_id, text, limit)
+
+        rows = await connections.get("default").execute_query_dict(
+            cls.SEARCH_QUERY, [" ".join(words), guild_id, limit, common_ticket_lexemes]
+        )
+        return [(row["thread_id"], row["title"]) for row in rows]
+
+    @classmethod
+    async def refresh_common_lexemes(cls):
+        "Пересчитывает `common_ticket_lexemes` по всем решённым вопросам (только Postgres)"
+        rows = await connections.get("default").execute_query_dict(
+            cls.COMMON_LEXEMES_QUERY, [SEARCH_COMMON_TERM_DOCS]
+        )
+        common_ticket_lexemes[:] = [row["word"] for row in rows]
+
+    @classmethod
+    async def build_search_index(cls):
+        """
+            Заполняет `ticket_search_index` всеми решёнными вопросами, если в базе нет
+            полнотекстового поиска, а иначе считает частые лексемы
+        """
+        if cls._has_fulltext_search():
+            return await cls.refresh_common_lexemes()
+
+        rows = await (cls
+                      .filter(status=TicketStatus.resolved)
+                      .values_list("guild_id", "thread_id", "title", "solution_text"))
+        for guild_id, thread_id, title, solution_text in rows:
+            ticket_search_index.add(guild_id, thread_id, title, solution_text)
+
+    @classmethod
+    async def _move_overdue(cls, from_statuses: list[TicketStatus], to_status: TicketStatus,
+                            created_before: datetime, limit: int) -> list[int]:
+        rows = await (cls
+                      .filter(status__in=from_statuses, created_at__lt=created_before)
+                      .order_by("created_at")
+                      .limit(limit)
+                      .values_list("id", "thread_id"))
+        if not rows:
+            return []
+
+        # Вопрос могли решить между двумя запросами, поэтому ветки и кеш меняются
+        # только для строк, которые обновил сам UPDATE
+        ids = ", ".join(str(int(ticket_id)) for ticket_id, _ in rows)
+        statuses = ", ".join(str(status.value) for status in from_statuses)
+        updated = await connections.get("default").execute_query_dict(f"""
+            UPDATE "ticket" SET "status" = {to_status.value}
+            WHERE "id" IN ({ids}) AND "status" IN ({statuses})
+            RETURNING "thread_id"
+        """)
+
+        thread_ids = [row["thread_id"] for row in updated]
+        for thread_id in thread_ids:
+            cached = ticket_cache.peek(thread_id)
+            if cached is not None:
+                ticket_cache.set(thread_id, cached._replace(status=to_status))
+        return thread_ids
+
+    @classmethod
+    async def escalate_overdue(cls, created_before: datetime, limit: int) -> list[int]:
+        """
+            Помечает горящими до `limit` вопросов без ответа, созданных раньше `created_before`.
+            Возвращает id веток изменённых вопросов
+        """
+        return await cls._move_overdue([TicketStatus.created], TicketStatus.burning,
+                                       created_before, limit)
+
+    @classmethod
+    async def archive_overdue(cls, created_before: datetime, limit: int) -> list[int]:
+        "То же, что `escalate_overdue`, но переводит открытые и горящие вопросы в архив"
+        return await cls._move_overdue([TicketStatus.created, TicketStatus.burning],
+                                       TicketStatus.archived, created_before, limit)
+
+    @classmethod
+    async def warm_cache(cls):
+        "Загружает в кеш последние нерешённые вопросы одним запросом"
+        rows = await (cls
+                      .filter(status__in=[TicketStatus.created, TicketStatus.burning])
+                      .order_by("-id")
+                      .limit(ticket_cache.maxsize)
+                      .values_list("thread_id", "id", "status", "bounty", "starter_message_id"))
+        for thread_id, ticket_id, status, bounty, starter_message_id in reversed(rows):
+            ticket_cache.set(
+                thread_id, TicketInfo(ticket_id, TicketStatus(status), bounty, starter_message_id)
+            )
+
+
+class TicketDailyStats(tortoise.Model):
+    """
+        Дневная сводка по вопросам сервера: сколько создано и решено за день.
+        Строится только в Postgres. Перцентили времени решения нельзя сложить из дневных,
+        поэтому они считаются по самим вопросам для каждого окна `STATS_WINDOWS`,
+        см. `refresh_resolution_times`
+    """
+    day = tortoise.fields.DateField()
+    guild_id = tortoise.fields.BigIntField()
+    priority = tortoise.fields.IntEnumField(TicketPriority)
+    created = tortoise.fields.IntField(default=0)
+    resolved = tortoise.fields.IntField(default=0)
+
+    class Meta:
+        unique_together = (("day", "guild_id", "priority"),)
+
+    REFRESH_QUERY = """
+        INSERT INTO "ticketdailystats" ("day", "guild_id", "priority", "created", "resolved")
+        SELECT "day", "guild_id", "priority", SUM("created"), SUM("resolved")
+        FROM (
+            SELECT ("created_at" AT TIME ZONE 'UTC')::date AS "day", "guild_id", "priority",
+                   COUNT(*) AS "created", 0 AS "resolved"
+            FROM "ticket"
+            WHERE "created_at" >= $1
+            GROUP BY 1, 2, 3
+            UNION ALL
+            SELECT ("resolved_at" AT TIME ZONE 'UTC')::date, "guild_id", "priority", 0, COUNT(*)
+            FROM "ticket"
+            WHERE "status" = $2 AND "resolved_at" >= $1
+            GROUP BY 1, 2, 3
+        ) AS "events"
+        GROUP BY "day", "guild_id", "priority"
+    """
+
+    # Окно в N дней начинается в полночь UTC N-1 дней назад, как и дни сводки
+    RESOLUTION_TIMES_QUERY = """
+        SELECT "guild_id", "priority", "days",
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM "resolved_at" - "created_at")) AS "p50",
+               percentile_cont(0.9) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM "resolved_at" - "created_at")) AS "p90"
+        FROM "ticket" CROSS JOIN unnest($3::int[]) AS "days"
+        WHERE "status" = $2 AND "resolved_at" >= $4
+          AND "resolved_at" >= $1::timestamptz - ("days" - 1) * INTERVAL '1 day'
+        GROUP BY "guild_id", "priority", "days"
+    """
+
+    @classmethod
+    async def refresh(cls) -> date:
+        """
+            Пересчитывает сводку начиная с последнего посчитанного дня: вопросы создаются
+            и решаются только "сейчас", поэтому более ранние дни уже не меняются.
+            Возвращает первый пересчитанный день
+        """
+        last = await cls.all().order_by("-day").first().values_list("day", flat=True)
+        start = last or date(1970, 1, 1)
+        async with in_transaction() as connection:
+            await cls.filter(day__gte=start).using_db(connection).delete()
+            await connection.execute_query(cls.REFRESH_QUERY, [
+                datetime.combine(start, time(), timezone.utc), TicketStatus.resolved.value
+            ])
+        return start
+
+    @classmethod
+    async def refresh_resolution_times(cls, today: date) -> None:
+        """
+            Пересчитывает `ticket_resolution_times`: медиану и p90 времени решения (в секундах)
+            вопросов каждого сервера за каждое окно `STATS_WINDOWS` одним запросом
+        """
+        midnight = datetime.combine(today, time(), timezone.utc)
+        rows = await connections.get("default").execute_query_dict(cls.RESOLUTION_TIMES_QUERY, [
+            midnight, TicketStatus.resolved.value, list(STATS_WINDOWS),
+            midnight - timedelta(days=max(STATS_WINDOWS) - 1),
+        ])
+        resolution_times: dict[tuple[int, int], dict[TicketPriority, tuple[float, float]]] = {}
+        for row in rows:
+            resolution_times.setdefault((row["guild_id"], row["days"]), {})[
+                TicketPriority(row["priority"])
+            ] = (row["p50"], row["p90"])
+        ticket_resolution_times.clear()
+        ticket_resolution_times.update(resolution_times)
+
+
+class HelperWeeklyStats(tortoise.Model):
+    "Сколько вопросов решил помощник за неделю и его место среди помощников сервера этой недели"
+    week = tortoise.fields.DateField()
+    guild_id = tortoise.fields.BigIntField()
+    helper_id = tortoise.fields.BigIntField()
+    resolved = tortoise.fields.IntField()
+    rank = tortoise.fields.IntField()
+
+    class Meta:
+        unique_together = (("week", "guild_id", "helper_id"),)
+
+    REFRESH_QUERY = """
+        INSERT INTO "helperweeklystats" ("week", "guild_id", "helper_id", "resolved", "rank")
+        SELECT "week", "guild_id", "helper_id", "resolved",
+               RANK() OVER (PARTITION BY "week", "guild_id" ORDER BY "resolved" DESC)
+        FROM (
+            SELECT date_trunc('week', "resolved_at" AT TIME ZONE 'UTC')::date AS "week",
+                   "guild_id", "helper_id", COUNT(*) AS "resolved"
+            FROM "ticket"
+            WHERE "status" = $2 AND "resolved_at" >= $1
+              AND "helper_id" IS NOT NULL AND "helper_id" IS DISTINCT FROM "owner_id"
+            GROUP BY 1, 2, 3
+        ) AS "weekly"
+    """
+
+    @staticmethod
+    def week_of(day: date) -> date:
+        return day - timedelta(days=day.weekday())
 
     @classmethod
-    async def resolve(cls, thread_id: int, helper_id: int):
-        ticket = await cls.get(thread_id=thread_id)
-        ticket.resolved_at = datetime.now()
-        ticket.status = TicketStatus.resolved
-        ticket.helper_id = helper_id
-        await ticket.save()
-        return ticket
\ No newline at end of file
+    async def refresh(cls, since: date):
+        "Пересчитывает недели, начиная с недели дня `since`"
+        start = cls.week_of(since)
+        async with in_transaction() as connection:
+            await cls.filter(week__gte=start).using_db(connection).delete()
+            await connection.execute_query(cls.REFRESH_QUERY, [
+                datetime.combine(start, time(), timezone.utc), TicketStatus.resolved.value
+            ])
+
+
+class LedgerEvent(tortoise.Model):
+    """
+        Журнал событий вопросов и репутации. Записи только добавляются и не ссылаются
+        на `User`, поэтому переживают удаление пользователя. Пишется пачками через `ledger.Ledger`
+    """
+    id = tortoise.fields.BigIntField(primary_key=True)
+    kind = tortoise.fields.IntEnumField(LedgerEventKind)
+    user_id = tortoise.fields.BigIntField()
+    guild_id = tortoise.fields.BigIntField(null=True)
+    thread_id = tortoise.fields.BigIntField(null=True)
+    # Награда за вопрос, изменение репутации или новый уровень, в зависимости от `kind`
+    amount = tortoise.fields.IntField(null=True)
+    created_at = tortoise.fields.DatetimeField()
+
+    class Meta:
+        indexes = (("user_id", "id"),)
+
+    COPY_COLUMNS = ("kind", "user_id", "guild_id", "thread_id", "amount", "created_at")
+
+    @classmethod
+    async def write_batch(cls, rows: list[tuple]):
+        "Записывает строки со значениями `COPY_COLUMNS`: в Postgres через COPY, иначе одним INSERT"
+        client = connections.get("default")
+        if client.capabilities.dialect == "postgres":
+            async with client.acquire_connection() as connection:
+                await connection.copy_records_to_table(
+                    cls._meta.db_table, records=rows, columns=cls.COPY_COLUMNS
+                )
+            return
+
+        await cls.bulk_create([cls(**dict(zip(cls.COPY_COLUMNS, row))) for row in rows])
+
+    @classmethod
+    async def for_user(cls, user_id: int, limit: int) -> list["LedgerEvent"]:
+        "Последние `limit` событий пользователя, новые первыми"
+        return await cls.filter(user_id=user_id).order_by("-id").limit(limit)
+
+
+async def refresh_stats():
+    await HelperWeeklyStats.refresh(await TicketDailyStats.refresh())
+    await TicketDailyStats.refresh_resolution_times(datetime.now(timezone.utc).date())
+
+
+# generate_schemas(safe=True) создаёт только отсутствующие таблицы, поэтому изменения
+# схемы для уже существующих баз применяются здесь. Все запросы должны быть идемпотентными
+POSTGRES_MIGRATIONS = [
+    # Дубликаты заявок мешают созданию уникального индекса
+    'DELETE FROM "reviewentry" a USING "reviewentry" b '
+    'WHERE a.id > b.id AND a.review_id = b.review_id AND a.discord_id = b.discord_id',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "uid_reviewentry_review__0181e0" '
+    'ON "reviewentry" ("review_id", "discord_id")',
+    # Ревью, созданные до поддержки нескольких серверов, относятся к основному серверу
+    f'ALTER TABLE "review" ADD COLUMN IF NOT EXISTS "guild_id" BIGINT NOT NULL DEFAULT {BOT_MAIN_GUILD}',
+    # Старые вопросы получают id стартового сообщения фоновой задачей `ticket_starter_backfill`
+    'ALTER TABLE "ticket" ADD COLUMN IF NOT EXISTS "starter_message_id" BIGINT',
+    # Раньше приоритет вопросов Boosty не сохранялся, но их награда всегда была увеличенной
+    f'UPDATE "ticket" SET "priority" = {TicketPriority.golden.value} '
+    f'WHERE "priority" = {TicketPriority.regular.value} AND "bounty" >= {5 * BOOSTY_HELP_MULTIPLIER}',
+    # Вопросы, созданные до поддержки нескольких серверов, относятся к основному серверу
+    f'ALTER TABLE "ticket" ADD COLUMN IF NOT EXISTS "guild_id" BIGINT NOT NULL DEFAULT {BOT_MAIN_GUILD}',
+    # У старых вопросов нет названия и решения, поэтому их не будет среди похожих
+    'ALTER TABLE "ticket" ADD COLUMN IF NOT EXISTS "title" VARCHAR(100)',
+    'ALTER TABLE "ticket" ADD COLUMN IF NOT EXISTS "solution_text" TEXT',
+    'ALTER TABLE "ticket" ADD COLUMN IF NOT EXISTS "search_vector" tsvector GENERATED ALWAYS AS ('
+    "setweight(to_tsvector('russian', coalesce(\"title\", '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(\"solution_text\", '')), 'B')) STORED",
+    'CREATE INDEX IF NOT EXISTS "idx_ticket_search_vector" ON "ticket" USING GIN ("search_vector") '
+    f'WHERE "status" = {TicketStatus.resolved.value}',
+    # Вышедшие участники помечаются, а не удаляются (см. `User.purge_departed`)
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS "left_at" TIMESTAMPTZ',
+    'CREATE INDEX IF NOT EXISTS "idx_user_left_at" ON "user" ("left_at") WHERE "left_at" IS NOT NULL',
+    # Вопросы переживают удаление автора или помощника, иначе вместе с ними пропала бы репутация
+    'ALTER TABLE "ticket" ALTER COLUMN "owner_id" DROP NOT NULL',
+    'ALTER TABLE "ticket" DROP CONSTRAINT IF EXISTS "ticket_owner_id_fkey", '
+    'ADD CONSTRAINT "ticket_owner_id_fkey" FOREIGN KEY ("owner_id") REFERENCES "user" ("id") ON DELETE SET NULL',
+    'ALTER TABLE "ticket" DROP CONSTRAINT IF EXISTS "ticket_helper_id_fkey", '
+    'ADD CONSTRAINT "ticket_helper_id_fkey" FOREIGN KEY ("helper_id") REFERENCES "user" ("id") ON DELETE SET NULL',
+    # Сводки статистики считаются по серверам. Старые строки без сервера удаляются,
+    # и `refresh_stats` пересчитывает сводки целиком
+    'ALTER TABLE "ticketdailystats" ADD COLUMN IF NOT EXISTS "guild_id" BIGINT',
+    'DELETE FROM "ticketdailystats" WHERE "guild_id" IS NULL',
+    'ALTER TABLE "ticketdailystats" ALTER COLUMN "guild_id" SET NOT NULL',
+    'ALTER TABLE "ticketdailystats" DROP CONSTRAINT IF EXISTS "uid_ticketdaily_day_f3c40c"',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "uid_ticketdaily_day_784523" ON "ticketdailystats" ("day", "guild_id", "priority")',
+    'ALTER TABLE "helperweeklystats" ADD COLUMN IF NOT EXISTS "guild_id" BIGINT',
+    'DELETE FROM "helperweeklystats" WHERE "guild_id" IS NULL',
+    'ALTER TABLE "helperweeklystats" ALTER COLUMN "guild_id" SET NOT NULL',
+    'ALTER TABLE "helperweeklystats" DROP CONSTRAINT IF EXISTS "uid_helperweekl_week_f034fa"',
+    'CREATE UNIQUE INDEX IF NOT EXISTS "uid_helperweekl_week_5dab60" ON "helperweeklystats" ("week", "guild_id", "helper_id")',
+    'ALTER TABLE "ticketdailystats" DROP COLUMN IF EXISTS "resolution_p50"',
+    'ALTER TABLE "ticketdailystats" DROP COLUMN IF EXISTS "resolution_p90"',
+    # Перцентили времени решения считаются сразу для всех серверов
+    # (см. `TicketDailyStats.refresh_resolution_times`), поэтому индекс без guild_id
+    'DROP INDEX IF EXISTS "idx_ticket_resolved_at"',
+    'CREATE INDEX IF NOT EXISTS "idx_ticket_resolved" ON "ticket" ("resolved_at") '
+    f'WHERE "status" = {TicketStatus.resolved.value}',
+    # Повторный запуск `Review.close` не отправляет сообщения о завершении заново
+    'ALTER TABLE "review" ADD COLUMN IF NOT EXISTS "close_messages_sent" INT NOT NULL DEFAULT 0',
+    'ALTER TABLE "review" ADD COLUMN IF NOT EXISTS "channel_id" BIGINT',
+]
+
+
+class SchemaState(tortoise.Model):
+    "Хеш схемы, для которой уже выполнены generate_schemas и миграции"
+    key = tortoise.fields.CharField(max_length=32, primary_key=True)
+    hash = tortoise.fields.CharField(max_length=64)
+
+
+async def warm_caches():
+    await GuildSettings.load_all()
+    await Ticket.warm_cache()
+    await Ticket.build_search_index()
+    await User.build_leaderboard()
+
+
+async def run_migrations():
+    connection = connections.get("default")
+    if connection.capabilities.dialect != "postgres":
+        return
+
+    for statement in POSTGRES_MIGRATIONS:
+        await connection.execute_script(statement)
+
+
+async def ensure_schema() -> bool:
+    """
+        Создаёт таблицы и применяет миграции, только если с прошлого запуска изменились
+        модели или `POSTGRES_MIGRATIONS`. Возвращает `True`, если схема обновлялась
+    """
+    connection = connections.get("default")
+    schema = get_schema_sql(connection, safe=True)
+    if connection.capabilities.dialect == "postgres":
+        schema += "\n".join(POSTGRES_MIGRATIONS)
+    schema_hash = hashlib.sha256(schema.encode()).hexdigest()
+
+    try:
+        stored_hash = await SchemaState.get_or_none(key="schema").values_list("hash", flat=True)
+    except OperationalError:  # Первый запуск, таблицы ещё нет
+        stored_hash = None
+    if stored_hash == schema_hash:
+        return False
+
+    await Tortoise.generate_schemas(safe=True)
+    await run_migrations()
+    await SchemaState.update_or_create(key="schema", defaults={"hash": schema_hash})
+    return True
@@ -0,0 +1,111 @@
+import os
+import time
+import asyncpg
+
+from tortoise import connections
+from metrics import Gauge, Histogram, registry
+from settings import (POSTGRES_HOST, POSTGRES_PORT, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE,
+                      DB_POOL_MAX_INACTIVE_LIFETIME, DB_POOL_MAX_QUERIES,
+                      DB_STATEMENT_CACHE_SIZE)
+
+pool_acquire_seconds = registry.register(Histogram(
+    "bot_db_pool_acquire_seconds", "Ожидание свободного подключения из пула",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)))
+
+
+class InstrumentedPool(asyncpg.Pool):
+    "Пул asyncpg, который считает ожидающих подключения и время ожидания"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+
+    async def _acquire(self, timeout):
+        self.waiting += 1
+        started_at = time.perf_counter()
+        try:
+            return await super()._acquire(timeout)
+        finally:
+            self.waiting -= 1
+            pool_acquire_seconds.observe(time.perf_counter() - started_at)
+
+    def stats(self) -> dict[str, float]:
+        size, idle, max_size = self.get_size(), self.get_idle_size(), self.get_max_size()
+        return {
+            "size": size,
+            "idle": idle,
+            "max_size": max_size,
+            "waiting": self.waiting,
+            "saturation": (size - idle) / max_size,
+        }
+
+
+async def create_instrumented_pool(**kwargs) -> InstrumentedPool:
+    # Те же значения по умолчанию, что и у asyncpg.create_pool
+    options = {
+        "min_size": 10,
+        "max_size": 10,
+        "max_queries": 50000,
+        "max_inactive_connection_lifetime": 300.0,
+        "setup": None,
+        "init": None,
+        "loop": None,
+        "connection_class": asyncpg.Connection,
+        "record_class": asyncpg.Record,
+    }
+    options.update(kwargs)
+    return await InstrumentedPool(None, **options)
+
+
+def get_db_config() -> dict:
+    return {
+        "connections": {
+            "default": {
+                "engine": "tortoise.backends.asyncpg",
+                "credentials": {
+                    "host": POSTGRES_HOST,
+                    "port": POSTGRES_PORT,
+                    "user": os.getenv("POSTGRES_USER"),
+                    "password": os.getenv("POSTGRES_PASSWORD"),
+                    "database": os.getenv("POSTGRES_DB"),
+                    "minsize": DB_POOL_MIN_SIZE,
+                    "maxsize": DB_POOL_MAX_SIZE,
+                    "max_inactive_connection_lifetime": DB_POOL_MAX_INACTIVE_LIFETIME,
+                    "max_queries": DB_POOL_MAX_QUERIES,
+                    "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+                },
+            },
+        },
+        "apps": {
+            "discord": {"models": ["database"], "default_connection": "default"},
+        },
+    }
+
+
+def get_pool_stats() -> dict[str, float]:
+    pool = getattr(connections.get("default"), "_pool", None)
+    return pool.stats() if isinstance(pool, InstrumentedPool) else {}
+
+
+async def prewarm_pool():
+    """
+        Подменяет пул подключения по умолчанию на `InstrumentedPool` и сразу открывает его:
+        asyncpg создаёт `DB_POOL_MIN_SIZE` подключений при инициализации пула,
+        поэтому первые обработчики событий не ждут установки соединения
+    """
+    client = connections.get("default")
+    client.create_pool = create_instrumented_pool
+    started_at = time.perf_counter()
+    await client.execute_query("SELECT 1")
+
+    stats = get_pool_stats()
+    print(
+        f"Database pool is ready: {stats['size']} connections "
+        f"(max {stats['max_size']}) in {time.perf_counter() - started_at:.2f}s"
+    )
+
+    for field in ("size", "idle", "max_size", "waiting", "saturation"):
+        registry.register(Gauge(
+            f"bot_db_pool_{field}", f"Состояние пула подключений: {field}",
+            lambda field=field: get_pool_stats().get(field, float("nan")),
+        ))
@@ -1,16 +1,21 @@
 import discord
-import asyncio
 from discord.ui import View, button, Modal, InputText
-from settings import BOT_IMPORTANT_MESSAGES_CHANNEL, CODE_REVIEW_ROLE
-from database import Review, ReviewEntry
+from database import Review, ReviewEntry, get_guild_config
 from datetime import datetime, timedelta
+from typing import Optional
 from discord.ext import commands
-from utils import log_task_exceptions
+from tortoise.exceptions import IntegrityError
+from metrics import track_interaction
+from throttle import Throttle, allow_interaction
+from .export import WRITERS, export_review
 
 
 class ReviewFormModal(Modal):
-    def __init__(self, *args, **kwargs):
+    throttle = Throttle("review.submit")
+
+    def __init__(self, cog: "ReviewCog", *args, **kwargs):
         super().__init__(title="Запись на код-ревью", *args, **kwargs)
+        self.cog = cog
         self.add_item(InputText(
             label="Ссылка на репозиторий бота",
             placeholder="https://github.com/.../...",
@@ -40,46 +45,73 @@ class ReviewFormModal(Modal):
         ))
 
 
+    @track_interaction("review.submit")
     async def callback(self, interaction: discord.Interaction):
-        current_review = await Review.get_active_or_none().only("id")
+        # У модальных окон нет `interaction_check`, поэтому лимит проверяется здесь
+        if not await allow_interaction(self.throttle, interaction):
+            return
+
+        current_review = self.cog.active_review(interaction.guild_id)
         if not current_review:
             return await interaction.respond("Сбор заявок уже закончился")
 
+        participants = self.cog.get_participants(interaction.guild_id)
+        if interaction.user.id in participants:
+            return await interaction.respond("Вы уже записались на это код-ревью", ephemeral=True)
+
         git, description, modules, image = map(lambda x: x.value, self.children)
-        await ReviewEntry.create(
-            review=current_review,
-            discord_id=interaction.user.id,
-            description=description,
-            github_url=git,
-            architecture_image_url=image or None,
-            check_modules=modules,
-        )
+        try:
+            await ReviewEntry.create(
+                review_id=current_review.id,
+                discord_id=interaction.user.id,
+                description=description,
+                github_url=git,
+                architecture_image_url=image or None,
+                check_modules=modules,
+            )
+        except IntegrityError:
+            participants.add(interaction.user.id)
+            return await interaction.respond("Вы уже записались на это код-ревью", ephemeral=True)
 
+        participants.add(interaction.user.id)
         await interaction.respond("Вы успешно записаны на код-ревью!", ephemeral=True)
 
 
 class ReviewFormView(View):
-    def __init__(self, *args, **kwargs):
+    throttle = Throttle("review.buttons")
+
+    def __init__(self, cog: "ReviewCog", *args, **kwargs):
         super().__init__(*args, **kwargs, timeout=None)
+        self.cog = cog
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return await allow_interaction(self.throttle, interaction)
 
     @button(label="Записаться", style=discord.ButtonStyle.green, emoji="📃", custom_id="review-button-add")
+    @track_interaction("review.appoint")
     async def appoint(self, button: discord.ui.Button, interaction: discord.Interaction):
-        user_present = await Review.check_if_user_present(interaction.user.id)
-        if user_present is None:
+        if not self.cog.active_review(interaction.guild_id):
             return await interaction.respond("Сбор заявок уже завершён", ephemeral=True)
 
-        if user_present is True:
+        if interaction.user.id in self.cog.get_participants(interaction.guild_id):
             return await interaction.respond("Вы уже записались на это код-ревью", ephemeral=True)
 
-        await interaction.response.send_modal(ReviewFormModal())
+        await interaction.response.send_modal(ReviewFormModal(self.cog))
 
     @button(label="Отмена записи", style=discord.ButtonStyle.red, emoji="✖️", custom_id="review-button-cancel")
+    @track_interaction("review.cancel")
     async def cancel(self, button: discord.ui.Button, interaction: discord.Interaction):
-        status = await Review.delete_entry_if_present(interaction.user.id)
-
-        if status is None:
+        review = self.cog.active_review(interaction.guild_id)
+        if not review:
             return await interaction.respond("Сбор заявок завершён", ephemeral=True)
 
+        participants = self.cog.get_participants(interaction.guild_id)
+        if interaction.user.id not in participants:
+            return await interaction.respond("Вы ещё не записывались на это код-ревью", ephemeral=True)
+
+        status = await Review.delete_entry_if_present(interaction.user.id, review.id)
+        participants.discard(interaction.user.id)
+
         if status is True:
             return await interaction.respond("Вы отменили запись", ephemeral=True)
         
@@ -91,25 +123,55 @@ class ReviewCog(discord.Cog):
         super().__init__(*args, **kwargs)
         self.bot = bot
         self.on_ready_fired = False
-        self.review_instance = None
-        self.delete_task: asyncio.Task = None
+        # guild_id -> ревью сервера
+        self.reviews: dict[int, Review] = {}
+        # guild_id -> id участников активного ревью, чтобы отсеивать повторные нажатия без запросов в базу
+        self.participants: dict[int, set[int]] = {}
+        bot.scheduler.register("review_close", self.close_review)
+
+    def active_review(self, guild_id: int) -> Optional[Review]:
+        "Текущее ревью сервера, если сбор заявок на него ещё не закончился"
+        review = self.reviews.get(guild_id)
+        if review and review.seconds_until_finished > 0:
+            return review
+        return None
+
+    def get_participants(self, guild_id: int) -> set[int]:
+        return self.participants.setdefault(guild_id, set())
+
+    async def set_review(self, guild_id: int, review: Optional[Review]):
+        if review is None:
+            self.reviews.pop(guild_id, None)
+            self.participants.pop(guild_id, None)
+            return
+
+        self.reviews[guild_id] = review
+        self.participants[guild_id] = await review.get_participant_ids()
 
-    @log_task_exceptions
-    async def close_review_on_timeout(self, review: Review, bot: discord.Bot):
-        await asyncio.sleep(review.seconds_until_finished)
-        await review.close(bot)
-        self.review_instance = None
+    async def close_review(self, review_id: int):
+        review = await Review.get_or_none(id=review_id)
+        if not review:
+            return
+
+        await review.close(self.bot)
+        current = self.reviews.get(review.guild_id)
+        if current and current.id == review_id:
+            await self.set_review(review.guild_id, None)
 
     review = discord.SlashCommandGroup(name="review", checks=[commands.is_owner()])
 
     @review.command()
     async def launch(self, ctx: discord.ApplicationContext, days: int):
         await ctx.defer()
-        if self.review_instance:
+        config = get_guild_config(ctx.guild_id)
+        if not config:
+            return await ctx.respond("Этот сервер не настроен. Используйте /guild setup", ephemeral=True)
+
+        if ctx.guild_id in self.reviews:
             return await ctx.respond("Уже есть активное ревью!", ephemeral=True)
 
         await ctx.respond("Успешно создан", ephemeral=True)
-        end_date = datetime.now() + timedelta(days=days)
+        end_date = datetime.now().astimezone() + timedelta(days=days)
 
         embed = discord.Embed(
             description=(
@@ -130,17 +192,39 @@ class ReviewCog(discord.Cog):
             color=0x8ae378,
         )
 
-        roleToMention = ctx.guild.get_role(CODE_REVIEW_ROLE) or ctx.guild.default_role
-        message = await ctx.bot.get_channel(BOT_IMPORTANT_MESSAGES_CHANNEL).send(
+        roleToMention = ctx.guild.get_role(config.code_review_role_id) or ctx.guild.default_role
+        message = await ctx.bot.get_channel(config.important_messages_channel_id).send(
             roleToMention.mention,
             embed=embed,
-            view=ReviewFormView()
+            view=ReviewFormView(self)
         )
 
-        self.review_instance = review = await Review.create(message_id=message.id, closed_at=end_date)
-        if self.delete_task and not self.delete_task.done():
-            self.delete_task.cancel()
-        self.delete_task = asyncio.create_task(self.close_review_on_timeout(review, self.bot))
+        review = await Review.create(message_id=message.id, channel_id=message.channel.id,
+                                     closed_at=end_date, guild_id=ctx.guild_id)
+        await self.set_review(ctx.guild_id, review)
+        await self.bot.scheduler.schedule("review_close", end_date, review_id=review.id)
+
+    @review.command(description="Выгружает заявки на ревью файлом")
+    async def export(
+        self,
+        ctx: discord.ApplicationContext,
+        file_format: discord.Option(str, name="format", choices=list(WRITERS), default="csv"),
+        review_id: discord.Option(int, description="По умолчанию - последнее ревью сервера",
+                                  required=False, default=None),
+    ):
+        await ctx.defer(ephemeral=True)
+        review = await (Review.get_or_none(id=review_id, guild_id=ctx.guild_id) if review_id else
+                        Review.filter(guild_id=ctx.guild_id).order_by("-id").first())
+        if not review:
+            return await ctx.respond("Ревью не найдено", ephemeral=True)
+
+        fp, count = await export_review(review.id, file_format)
+        with fp:
+            await ctx.respond(
+                f"Заявок на ревью #{review.id}: **{count}**",
+                file=discord.File(fp, filename=f"review-{review.id}.{file_format}"),
+                ephemeral=True,
+            )
 
     @discord.Cog.listener()
     async def on_ready(self):
@@ -148,11 +232,11 @@ class ReviewCog(discord.Cog):
             return
         self.on_ready_fired = True
 
-        self.review_instance = await Review.get_active_or_none()
-        if self.review_instance and self.delete_task is None:
-            self.delete_task = asyncio.create_task(
-                self.close_review_on_timeout(self.review_instance, self.bot)
-            )
+        for review in await Review.filter_active():
+            await self.set_review(review.guild_id, review)
+            # Ревью, запущенное до появления планировщика, ещё не имеет задачи на закрытие
+            if not await self.bot.scheduler.has_job("review_close", review_id=review.id):
+                await self.bot.scheduler.schedule("review_close", review.closed_at, review_id=review.id)
 
     async def cog_command_error(self, ctx: discord.ApplicationContext, error: Exception) -> None:
         if isinstance(error, commands.NotOwner):
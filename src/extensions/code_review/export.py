@@ -0,0 +1,47 @@
+import io
+import csv
+import json
+import tempfile
+
+from typing import Any, AsyncIterator, BinaryIO
+from database import ReviewEntry
+
+
+async def write_csv(rows: AsyncIterator[dict[str, Any]], fp: BinaryIO) -> int:
+    text = io.TextIOWrapper(fp, encoding="utf-8-sig", newline="")
+    writer = csv.DictWriter(text, fieldnames=ReviewEntry.EXPORT_FIELDS)
+    writer.writeheader()
+    count = 0
+    async for row in rows:
+        writer.writerow(row)
+        count += 1
+    text.flush()
+    text.detach()
+    return count
+
+
+async def write_json(rows: AsyncIterator[dict[str, Any]], fp: BinaryIO) -> int:
+    "Пишет JSON-массив по одной записи, чтобы не собирать весь список в памяти"
+    fp.write(b"[")
+    count = 0
+    async for row in rows:
+        fp.write(b",\n" if count else b"\n")
+        fp.write(json.dumps(row, ensure_ascii=False).encode())
+        count += 1
+    fp.write(b"\n]\n")
+    return count
+
+
+WRITERS = {"csv": write_csv, "json": write_json}
+
+
+async def export_review(review_id: int, file_format: str) -> tuple[BinaryIO, int]:
+    "Выгружает заявки ревью во временный файл. Возвращает файл, перемотанный в начало, и число заявок"
+    fp = tempfile.TemporaryFile()
+    try:
+        count = await WRITERS[file_format](ReviewEntry.stream(review_id), fp)
+    except BaseException:
+        fp.close()
+        raise
+    fp.seek(0)
+    return fp, count
@@ -3,5 +3,6 @@ from .cogs import ReviewCog, ReviewFormView
 
 
 def setup(bot: discord.Bot):
-    bot.add_cog(ReviewCog(bot))
-    bot.add_view(ReviewFormView())
+    cog = ReviewCog(bot)
+    bot.add_cog(cog)
+    bot.add_view(ReviewFormView(cog))
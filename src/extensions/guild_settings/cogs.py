@@ -0,0 +1,70 @@
+import discord
+from discord.ext import commands
+from database import GuildSettings, get_guild_config
+
+
+class GuildSettingsCog(discord.Cog):
+    guild = discord.SlashCommandGroup(name="guild", checks=[commands.is_owner()])
+
+    @guild.command(name="setup", description="Задаёт каналы и роли бота на этом сервере")
+    async def setup_guild(
+        self,
+        ctx: discord.ApplicationContext,
+        help_forum: discord.ForumChannel,
+        bot_messages: discord.TextChannel,
+        important_messages: discord.TextChannel,
+        helper_role: discord.Role,
+        code_review_role: discord.Role = None,
+        welcome_role: discord.Role = None,
+        boosty_level1_role: discord.Role = None,
+        boosty_level2_role: discord.Role = None,
+        boosty_level3_role: discord.Role = None,
+        boosty_level4_role: discord.Role = None,
+        boosty_emoji: str = "",
+    ):
+        await GuildSettings.update_or_create(guild_id=ctx.guild_id, defaults={
+            "help_forum_id": help_forum.id,
+            "bot_message_channel_id": bot_messages.id,
+            "important_messages_channel_id": important_messages.id,
+            "helper_role_id": helper_role.id,
+            "code_review_role_id": code_review_role and code_review_role.id,
+            "welcome_role_id": welcome_role and welcome_role.id,
+            "boosty_level1_role_id": boosty_level1_role and boosty_level1_role.id,
+            "boosty_level2_role_id": boosty_level2_role and boosty_level2_role.id,
+            "boosty_level3_role_id": boosty_level3_role and boosty_level3_role.id,
+            "boosty_level4_role_id": boosty_level4_role and boosty_level4_role.id,
+            "boosty_emoji": boosty_emoji,
+        })
+        ctx.bot.dispatch("guild_settings_update", ctx.guild)
+        await ctx.respond("Настройки сервера сохранены", ephemeral=True)
+
+    @guild.command(name="show", description="Показывает настройки бота на этом сервере")
+    async def show_guild(self, ctx: discord.ApplicationContext):
+        config = get_guild_config(ctx.guild_id)
+        if not config:
+            return await ctx.respond("Этот сервер не настроен. Используйте /guild setup", ephemeral=True)
+
+        boosty_roles = ", ".join(f"<@&{role_id}>" for role_id in config.boosty_roles if role_id)
+        embed = discord.Embed(
+            title="⚙️ Настройки сервера",
+            description=(
+                f"Форум помощи: <#{config.help_forum_id}>\n"
+                f"Сообщения бота: <#{config.bot_message_channel_id}>\n"
+                f"Важные сообщения: <#{config.important_messages_channel_id}>\n"
+                f"Роль помощника: <@&{config.helper_role_id}>\n"
+                f"Роль код-ревью: {f'<@&{config.code_review_role_id}>' if config.code_review_role_id else '—'}\n"
+                f"Приветственная роль: {f'<@&{config.welcome_role_id}>' if config.welcome_role_id else '—'}\n"
+                f"Роли Boosty: {boosty_roles or '—'} {config.boosty_emoji}"
+            ),
+        )
+        await ctx.respond(embed=embed, ephemeral=True)
+
+    @discord.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        if not get_guild_config(guild.id):
+            print(f"Joined guild '{guild.name}' ({guild.id}), it is not configured yet. Use /guild setup")
+
+    async def cog_command_error(self, ctx: discord.ApplicationContext, error: Exception) -> None:
+        if isinstance(error, commands.NotOwner):
+            return await ctx.respond("Вы не являетесь владельцем этого бота")
+        raise error
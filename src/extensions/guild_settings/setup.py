@@ -0,0 +1,6 @@
+import discord
+from .cogs import GuildSettingsCog
+
+
+def setup(bot: discord.Bot):
+    bot.add_cog(GuildSettingsCog())
@@ -1,7 +1,19 @@
 import discord
-from discord.ext.commands import check
+from discord.ext.commands import check, MissingRole, NoPrivateMessage
 from .exceptions import NotAThreadOwner, ThreadAlreadyAnswered
-from database import Ticket, TicketStatus
+from database import Ticket, TicketStatus, get_guild_config
+
+
+def helper_role_only():
+    "То же, что `commands.has_role`, но роль помощника берётся из настроек сервера"
+    async def predicate(ctx: discord.ApplicationContext):
+        config = get_guild_config(ctx.guild_id)
+        if not isinstance(ctx.author, discord.Member) or not config:
+            raise NoPrivateMessage
+        if ctx.author.get_role(config.helper_role_id) is None:
+            raise MissingRole(config.helper_role_id)
+        return True
+    return check(predicate)
 
 
 def thread_owner_only():
@@ -14,7 +26,7 @@ def thread_owner_only():
 
 def no_thread_solution_yet():
     async def predicate(ctx: discord.ApplicationContext):
-        ticket = await Ticket.get_or_none(thread_id=ctx.channel_id).only("status")
+        ticket = await Ticket.get_info(ctx.channel_id)
         if not ticket or ticket.status == TicketStatus.resolved:
             raise ThreadAlreadyAnswered
         return True
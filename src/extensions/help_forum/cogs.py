@@ -1,31 +1,94 @@
+import time
 import discord
 import asyncio
-from discord.ext import commands
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from discord.ext import commands, tasks
 
 from tortoise.transactions import in_transaction
 from .views import JumpView
 from .exceptions import NotInHelpForum, ThreadAlreadyAnswered, NotAThreadOwner
-from settings import (BOOSTY_HELP_MULTIPLIER, HELP_FORUM_ID,
+from settings import (BOOSTY_HELP_MULTIPLIER,
                       INITIAL_MESSAGE_EMBED_IMAGE_URL,
-                      HELPER_ROLE_ID, BOT_MESSAGE_CHANNEL_ID) 
+                      LEADERBOARD_PAGE_SIZE, TICKET_SWEEP_INTERVAL_MINUTES,
+                      TICKET_BURNING_AFTER_HOURS, TICKET_ARCHIVE_AFTER_HOURS,
+                      TICKET_SWEEP_BATCH_SIZE, TICKET_SWEEP_EDIT_CONCURRENCY,
+                      TICKET_BACKFILL_BATCH_SIZE, STATS_REFRESH_MINUTES, STATS_WINDOWS,
+                      SIMILAR_TICKETS_LIMIT, LEDGER_HISTORY_LIMIT, USER_RETENTION_DAYS,
+                      SEARCH_LEXEMES_REFRESH_HOURS)
 from .checkers import (no_thread_solution_yet,
-                       thread_owner_only)
-from utils import get_boosty_level
-from database import Ticket, User, UserLevelChange
+                       thread_owner_only,
+                       helper_role_only)
+from outbox import MessagePriority
+from tortoise import connections
+from database import (Ticket, TicketInfo, TicketStatus, TicketPriority, User, UserLevelChange,
+                      TicketDailyStats, HelperWeeklyStats, LedgerEventKind, LedgerEvent,
+                      get_guild_config, boosty_index, leaderboard, ticket_resolution_times,
+                      refresh_stats)
+from ledger import ledger
+from supervisor import supervisor, RestartPolicy
+from throttle import Throttle, throttled
+from utils import format_duration, split_message
+from reputation import rebuild_reputation, describe_drift
+from common import CogWithBot
+from members import get_or_fetch_member
 
 
 class ReputationCog(discord.Cog):
+    reputation_admin = discord.SlashCommandGroup(name="reputation", checks=[commands.is_owner()])
+
+    @reputation_admin.command(description="Пересчитывает репутацию всех пользователей по истории вопросов")
+    async def rebuild(self, ctx: discord.ApplicationContext, apply: bool = False):
+        await ctx.defer(ephemeral=True)
+        diffs = await rebuild_reputation(apply)
+        lines = describe_drift(diffs)
+        if diffs:
+            lines.append("Изменения записаны" if apply else "Ничего не записано, запустите с `apply: True`")
+        for content in split_message(lines):
+            await ctx.respond(content, ephemeral=True)
+
+    LEDGER_EVENT_NAMES = {
+        LedgerEventKind.ticket_created: "❓ Задал вопрос",
+        LedgerEventKind.ticket_resolved: "✅ Решил вопрос",
+        LedgerEventKind.rep_changed: "🌟 Репутация",
+        LedgerEventKind.level_up: "⬆️ Новый уровень",
+        LedgerEventKind.member_left: "🚪 Покинул сервер",
+    }
+
+    @reputation_admin.command(description="Показывает историю вопросов и репутации пользователя")
+    async def history(self, ctx: discord.ApplicationContext, user: discord.User,
+                      limit: int = LEDGER_HISTORY_LIMIT):
+        await ctx.defer(ephemeral=True)
+        # События последних секунд ещё могут лежать в очереди
+        await ledger.flush()
+        events = await LedgerEvent.for_user(user.id, min(max(limit, 1), 500))
+
+        lines = [f"История {user.mention}:" if events else f"У {user.mention} нет событий в журнале"]
+        for event in events:
+            line = f"<t:{int(event.created_at.timestamp())}:f> {self.LEDGER_EVENT_NAMES[event.kind]}"
+            if event.kind == LedgerEventKind.rep_changed:
+                line += f" **{event.amount:+}**"
+            elif event.kind == LedgerEventKind.level_up:
+                line += f" **{event.amount}**"
+            if event.thread_id:
+                line += f" в <#{event.thread_id}>"
+            lines.append(line)
+
+        for content in split_message(lines):
+            await ctx.respond(content, ephemeral=True)
+
+    async def cog_command_error(self, ctx: discord.ApplicationContext, error: Exception) -> None:
+        if isinstance(error, commands.NotOwner):
+            return await ctx.respond("Вы не являетесь владельцем этого бота", ephemeral=True)
+        raise error
+
+    @throttled(Throttle("reputation.card"))
     @discord.user_command(name="Показать карточку участника 🌟")
     async def reputation_check(self, ctx: discord.ApplicationContext, member: discord.Member):
         if member.bot:
             return await ctx.respond("Вы не можете проверить уровень репутации у бота", ephemeral=True)
 
-        user = await (User
-                      .get_or_none(id=member.id)
-                      .only(
-                          "helper_reputation", "helper_level",
-                          "asked_questions", "resolved_questions"))
-        
+        user = await User.get_stats(member.id)
         if not user:
             return await ctx.respond("Этот пользователь больше не находится на этом сервере", ephemeral=True)
 
@@ -51,42 +114,114 @@ class ReputationCog(discord.Cog):
             ),
             color=member.color,
             thumbnail=member.display_avatar.url,
-            footer=discord.EmbedFooter("*При выходе с сервера данные сбрасываются")
+            footer=discord.EmbedFooter(f"*После выхода с сервера данные хранятся {USER_RETENTION_DAYS} дн.")
         )
 
         await ctx.respond(embed=embed, ephemeral=True)
-    
+
+    @discord.slash_command(description="Показывает лучших помощников сервера")
+    async def leaderboard(self, ctx: discord.ApplicationContext, page: int = 1):
+        helpers_count = await User.count_helpers(ctx.guild_id)
+        pages_count = max((helpers_count - 1) // LEADERBOARD_PAGE_SIZE + 1, 1)
+        page = min(max(page, 1), pages_count)
+        offset = (page - 1) * LEADERBOARD_PAGE_SIZE
+
+        # Место и репутация - по вопросам этого сервера, а уровень помощника общий
+        rows = await User.get_leaderboard_page(ctx.guild_id, offset, LEADERBOARD_PAGE_SIZE)
+        lines = [
+            f"**{place}.** <@{user_id}> — **{rep}** реп. ({level} ур.)"
+            for place, (user_id, rep, level) in enumerate(rows, start=offset + 1)
+        ]
+
+        rank = await User.get_rank(ctx.guild_id, ctx.author.id)
+        embed = discord.Embed(
+            title="🏆 Лучшие помощники",
+            description="\n".join(lines) or "Пока никто не получил репутацию помощника",
+            color=0xFFD700,
+            footer=discord.EmbedFooter(
+                f"Страница {page}/{pages_count} • "
+                + (f"Ваше место: {rank}" if rank else "У вас пока нет репутации")
+            )
+        )
+
+        await ctx.respond(embed=embed, ephemeral=True)
+
 
 class HelpCog(discord.Cog):
     def __init__(self, bot: discord.Bot):
         super().__init__()
         self.bot = bot
+        self.on_ready_fired = False
+        bot.scheduler.register("ticket_starter_backfill", self.backfill_starter_messages)
+        supervisor.adopt("search: common lexemes", self.refresh_lexemes, restart=RestartPolicy.on_failure)
+
+    def cog_unload(self):
+        self.refresh_lexemes.cancel()
+
+    @tasks.loop(hours=SEARCH_LEXEMES_REFRESH_HOURS)
+    async def refresh_lexemes(self):
+        # Без Postgres поиск идёт по `ticket_search_index`, который дополняется при решении вопросов
+        if connections.get("default").capabilities.dialect != "postgres":
+            return self.refresh_lexemes.stop()
+        # При запуске лексемы уже посчитаны в `Ticket.build_search_index`
+        if self.refresh_lexemes.current_loop == 0:
+            return
+
+        started_at = time.perf_counter()
+        await Ticket.refresh_common_lexemes()
+        print(f"Common search lexemes refreshed in {time.perf_counter() - started_at:.2f}s")
+
+    @refresh_lexemes.before_loop
+    async def before_refresh_lexemes(self):
+        await self.bot.wait_until_ready()
 
     ticket_command = discord.SlashCommandGroup(
         name="ticket",
         checks=[commands.check_any(
-            commands.has_role(HELPER_ROLE_ID),
+            helper_role_only(),
             commands.is_owner()
         )]
     )
     
     @discord.Cog.listener()
     async def on_thread_create(self, thread: discord.Thread):
-        if not thread.parent_id == HELP_FORUM_ID:
+        config = get_guild_config(thread.guild.id)
+        if not config or not thread.parent_id == config.help_forum_id:
             return
 
-        boostyEligible = get_boosty_level(thread.owner) >= 1
+        title = thread.name
+        boostyLevel = boosty_index.lookup(thread.guild.id, thread.owner_id)
+        if boostyLevel is None:
+            # Без кеша участников `thread.owner` может быть None
+            try:
+                owner = thread.owner or await get_or_fetch_member(thread.guild, thread.owner_id)
+            except discord.HTTPException:
+                owner = None
+            boostyLevel = boosty_index.get(owner) if owner else 0
+
+        boostyEligible = boostyLevel >= 1
+        bounty = 5 * BOOSTY_HELP_MULTIPLIER if boostyEligible else 5
+        # Вопрос записывается до любых запросов к Discord и поиска похожих,
+        # чтобы их ошибки не потеряли вопрос, а решение можно было отметить сразу
         async with in_transaction():
-            bounty = 5
             await Ticket.create(
                 owner_id=thread.owner_id,
                 thread_id=thread.id,
-                bounty=(bounty * BOOSTY_HELP_MULTIPLIER if boostyEligible else bounty)
+                bounty=bounty,
+                priority=(TicketPriority.golden if boostyEligible else TicketPriority.regular),
+                guild_id=thread.guild.id,
+                title=title,
             )
-            user = await User.get(id=thread.owner_id).only("id", "asked_questions")
+            user = await User.get_or_none(id=thread.owner_id).only("id", "asked_questions")
+            if user is None:
+                # Запись участника при входе не удалась
+                user, _ = await User.get_or_create(id=thread.owner_id)
             user.asked_questions += 1
             await user.save(update_fields=["asked_questions"])
 
+        ledger.record(LedgerEventKind.ticket_created, thread.owner_id,
+                      guild_id=thread.guild.id, thread_id=thread.id, amount=bounty)
+
         embed = discord.Embed(
             title="Вопрос создан!",
             description=(
@@ -105,9 +240,85 @@ class HelpCog(discord.Cog):
                 f"> За ответ на этот вопрос будет выдано в **{BOOSTY_HELP_MULTIPLIER}** "
                 "раза больше репутации помощника\n\n" + embed.description
             )
-            await thread.edit(name="⭐ "+thread.name)
+            try:
+                await thread.edit(name="⭐ "+thread.name)
+            except discord.HTTPException as e:
+                print(f"Не смог переименовать приоритетный вопрос {thread.id}: {e}")
+
+        # Ищем только по короткому названию: число слов запроса ограничивает число кандидатов
+        try:
+            similar = await Ticket.find_similar(thread.guild.id, title, SIMILAR_TICKETS_LIMIT)
+        except Exception as e:
+            print(f"Не смог найти похожие вопросы для ветки {thread.id}: {e}")
+            similar = []
+        if similar:
+            links = []
+            for thread_id, similar_title in similar:
+                similar_title = discord.utils.escape_markdown(similar_title or "Без названия")
+                similar_title = similar_title.replace("]", "\\]")
+                links.append(
+                    f"• [{similar_title}]"
+                    f"(https://discord.com/channels/{thread.guild.id}/{thread_id})"
+                )
+            embed.add_field(name="🔎 Похожие решённые вопросы", value="\n".join(links))
+
+        try:
+            message = await thread.send(embed=embed)
+        except discord.HTTPException as e:
+            # Без id сообщения кнопку перехода к решению найдёт `attach_jump_view` по истории ветки
+            return print(f"Не смог отправить приветствие в ветку {thread.id}: {e}")
+        await Ticket.set_starter_message(thread.id, message.id)
+
+    @staticmethod
+    async def find_starter_message(thread: discord.Thread) -> Optional[discord.Message]:
+        "Первое сообщение после поста автора - приветствие бота"
+        return await anext(thread.history(
+            after=thread.created_at,
+            limit=1,
+            oldest_first=True
+        ), None)
+
+    async def attach_jump_view(self, thread: discord.Thread, ticket: TicketInfo, url: str):
+        if ticket.starter_message_id:
+            await thread.get_partial_message(ticket.starter_message_id).edit(view=JumpView(url))
+            return
+
+        # Вопросы, для которых фоновая задача ещё не нашла стартовое сообщение
+        starting_message = await self.find_starter_message(thread)
+        if starting_message:
+            await starting_message.edit(view=JumpView(url))
+
+    async def backfill_starter_messages(self):
+        "Находит стартовые сообщения старых нерешённых вопросов пачками по `TICKET_BACKFILL_BATCH_SIZE`"
+        thread_ids = await Ticket.without_starter_message(TICKET_BACKFILL_BATCH_SIZE)
+        for thread_id in thread_ids:
+            try:
+                thread = self.bot.get_channel(thread_id) or await self.bot.fetch_channel(thread_id)
+                message = await self.find_starter_message(thread)
+            except discord.HTTPException as e:
+                # Иначе та же ветка снова окажется первой в следующей пачке
+                if not isinstance(e, discord.NotFound):
+                    print(f"Не смог найти стартовое сообщение вопроса в ветке {thread_id}: {e}")
+                message = None
+            # 0 - искать больше не нужно, решение будет искать сообщение по истории ветки
+            await Ticket.set_starter_message(thread_id, message.id if message else 0)
 
-        await thread.send(embed=embed)
+        if len(thread_ids) == TICKET_BACKFILL_BATCH_SIZE:
+            await self.bot.scheduler.schedule("ticket_starter_backfill", datetime.now().astimezone())
+        elif thread_ids:
+            print(f"Starter message backfill finished, last batch: {len(thread_ids)} tickets")
+
+    @discord.Cog.listener()
+    async def on_ready(self):
+        if self.on_ready_fired:
+            return
+        self.on_ready_fired = True
+
+        if (
+            await Ticket.without_starter_message(limit=1) and
+            not await self.bot.scheduler.has_job("ticket_starter_backfill")
+        ):
+            await self.bot.scheduler.schedule("ticket_starter_backfill", datetime.now().astimezone())
 
     @discord.Cog.listener()
     async def on_user_help_level_up(self, member: discord.Member, new_level: int):
@@ -124,8 +335,12 @@ class HelpCog(discord.Cog):
             color=0xFFD700
         )
 
-        await self.bot.get_channel(BOT_MESSAGE_CHANNEL_ID).send(member.mention, embed=embed)
-        
+        config = get_guild_config(member.guild.id)
+        if not config:
+            return
+        self.bot.outbox.send(config.bot_message_channel_id, member.mention, embed=embed,
+                             priority=MessagePriority.high)
+
 
     @discord.message_command(name="Пометить как решение ✅")
     @no_thread_solution_yet()
@@ -149,37 +364,43 @@ class HelpCog(discord.Cog):
             ]
         )
 
-        ticket = await Ticket.resolve(thread_id=ctx.channel_id, helper_id=message.author.id)
+        ticket = await Ticket.resolve(thread_id=ctx.channel_id, helper_id=message.author.id,
+                                      solution_text=message.content)
+        if not ticket:
+            raise ThreadAlreadyAnswered
+
+        event = {"guild_id": ctx.guild_id, "thread_id": ctx.channel_id}
+        ledger.record(LedgerEventKind.ticket_resolved, message.author.id, **event)
         if message.author.id == ctx.author.id: # Ответил на свой же вопрос
             success_embed.description = "Вы пометили свой ответ как решение вопроса"
         else:
             success_embed.description = f"Вопрос решён пользователем {message.author.mention}"
 
             async with in_transaction():
-                user = await User.get(id=message.author.id)
+                user = await User.get_or_none(id=message.author.id)
+                if user is None:
+                    user, _ = await User.get_or_create(id=message.author.id)
                 user.resolved_questions += 1
                 level_change, level = await user.change_rep(ticket.bounty)
                 await user.save()
                 if level_change == UserLevelChange.level_up:
                     ctx.bot.dispatch("user_help_level_up", message.author, level)
+            leaderboard.add(ctx.guild_id, message.author.id, ticket.bounty, level)
+
+            ledger.record(LedgerEventKind.rep_changed, message.author.id, amount=ticket.bounty, **event)
+            if level_change == UserLevelChange.level_up:
+                ledger.record(LedgerEventKind.level_up, message.author.id, amount=level, **event)
 
-        # Маленький кусочек непонятного кода. Мне так захотелось)
-        data = await asyncio.gather(
+        await asyncio.gather(
             message.add_reaction("✅"),
             ctx.respond(embed=success_embed),
-            anext(ctx.channel.history(
-                after=ctx.channel.created_at,
-                limit=1,
-                oldest_first=True
-            ))
+            self.attach_jump_view(ctx.channel, ticket, message.jump_url),
         )
 
-        starting_message = data[2]
-        await starting_message.edit(view=JumpView(message.jump_url))
-
     @ticket_command.command(description="Переименовывает текущий вопрос")
     async def rename(self, ctx: discord.ApplicationContext, new_name: str):
         await ctx.channel.edit(name=new_name)
+        await Ticket.filter(thread_id=ctx.channel_id).update(title=new_name[:100])
         await ctx.respond(f"Пользователь {ctx.author.mention} изменил название")
 
     @ticket_command.command(description="Закрывает текущий вопрос")
@@ -193,17 +414,24 @@ class HelpCog(discord.Cog):
         await ctx.respond(f"Вопрос открыт")
 
     def cog_check(self, ctx: discord.ApplicationContext):
+        config = get_guild_config(ctx.guild_id)
         if (
+            not config or
             ctx.channel.type != discord.ChannelType.public_thread or
-            ctx.channel.parent_id != HELP_FORUM_ID
+            ctx.channel.parent_id != config.help_forum_id
         ):
             raise NotInHelpForum
         return True
     
     async def cog_command_error(self, ctx: discord.ApplicationContext, error: Exception):
+        if isinstance(error, discord.ApplicationCommandInvokeError):
+            error = error.original
+
         if isinstance(error, NotInHelpForum):
+            config = get_guild_config(ctx.guild_id)
             await ctx.respond(
-                f"Эта команда может быть использована только в <#{HELP_FORUM_ID}>",
+                f"Эта команда может быть использована только в <#{config.help_forum_id}>"
+                if config else "На этом сервере не настроен форум помощи",
                 ephemeral=True
             )
         elif isinstance(error, commands.MissingRole):
@@ -226,4 +454,157 @@ class HelpCog(discord.Cog):
             await ctx.respond(
                 "Это не ваш вопрос",
                 ephemeral=True
-            )
\ No newline at end of file
+            )
+
+
+class TicketSweeperCog(CogWithBot):
+    """
+        Периодически помечает горящими вопросы без ответа и архивирует совсем старые.
+        Каждый проход выбирает по индексу (status, created_at) только те вопросы,
+        статус которых нужно поменять
+    """
+
+    def __init__(self, bot: discord.Bot, *args, **kwargs):
+        super().__init__(bot, *args, **kwargs)
+        self.edit_semaphore = asyncio.Semaphore(TICKET_SWEEP_EDIT_CONCURRENCY)
+        supervisor.adopt("tickets: sweep", self.sweep, restart=RestartPolicy.on_failure)
+
+    def cog_unload(self):
+        self.sweep.cancel()
+
+    async def edit_thread(self, thread_id: int, archive: bool):
+        async with self.edit_semaphore:
+            try:
+                thread = self.bot.get_channel(thread_id) or await self.bot.fetch_channel(thread_id)
+                if archive:
+                    await thread.archive()
+                elif not thread.name.startswith("🔥"):
+                    await thread.edit(name=("🔥 " + thread.name)[:100])
+            except discord.HTTPException as e:
+                print(f"Не смог обновить ветку вопроса {thread_id}: {e}")
+
+    async def process_overdue(self, move, created_before: datetime, archive: bool) -> int:
+        changed = 0
+        while True:
+            thread_ids = await move(created_before, TICKET_SWEEP_BATCH_SIZE)
+            changed += len(thread_ids)
+            await asyncio.gather(*(self.edit_thread(thread_id, archive) for thread_id in thread_ids))
+            if len(thread_ids) < TICKET_SWEEP_BATCH_SIZE:
+                return changed
+
+    @tasks.loop(minutes=TICKET_SWEEP_INTERVAL_MINUTES)
+    async def sweep(self):
+        now = datetime.now().astimezone()
+        archived = await self.process_overdue(
+            Ticket.archive_overdue, now - timedelta(hours=TICKET_ARCHIVE_AFTER_HOURS), archive=True
+        )
+        burning = await self.process_overdue(
+            Ticket.escalate_overdue, now - timedelta(hours=TICKET_BURNING_AFTER_HOURS), archive=False
+        )
+        if archived or burning:
+            print(f"Ticket sweep: {burning} tickets are now burning, {archived} archived")
+
+    @sweep.before_loop
+    async def before_sweep(self):
+        await self.bot.wait_until_ready()
+
+
+class StatsCog(CogWithBot):
+    """
+        Статистика форума помощи. Дневные и недельные сводки пересчитываются
+        фоновой задачей (только в Postgres), а команда читает готовые строки
+    """
+
+    def __init__(self, bot: discord.Bot, *args, **kwargs):
+        super().__init__(bot, *args, **kwargs)
+        self.refreshed_at: Optional[datetime] = None
+        supervisor.adopt("stats: refresh", self.refresh, restart=RestartPolicy.on_failure)
+
+    def cog_unload(self):
+        self.refresh.cancel()
+
+    @tasks.loop(minutes=STATS_REFRESH_MINUTES)
+    async def refresh(self):
+        # percentile_cont и date_trunc есть только в Postgres
+        if connections.get("default").capabilities.dialect != "postgres":
+            return self.refresh.stop()
+
+        await refresh_stats()
+        self.refreshed_at = datetime.now().astimezone()
+
+    @refresh.before_loop
+    async def before_refresh(self):
+        await self.bot.wait_until_ready()
+
+    @staticmethod
+    def summarize(rows: list[dict], resolution_times: Optional[tuple[float, float]]) -> str:
+        created = sum(row["created"] for row in rows)
+        resolved = sum(row["resolved"] for row in rows)
+        if resolution_times is None:
+            return f"Создано: **{created}**, решено: **{resolved}**"
+
+        p50, p90 = resolution_times
+        return (
+            f"Создано: **{created}**, решено: **{resolved}**\n"
+            f"Время решения: медиана **{format_duration(p50)}**, p90 **{format_duration(p90)}**"
+        )
+
+    @discord.slash_command(description="Статистика форума помощи")
+    async def stats(
+        self, ctx: discord.ApplicationContext,
+        days: discord.Option(int, description="Период в днях", choices=list(STATS_WINDOWS), default=7),
+    ):
+        if self.refreshed_at is None:
+            return await ctx.respond("Статистика ещё не посчитана, попробуйте позже", ephemeral=True)
+
+        # Дни сводки считаются по UTC
+        today = datetime.now(timezone.utc).date()
+        first_day = today - timedelta(days=days - 1)
+        rows = await (TicketDailyStats
+                      .filter(guild_id=ctx.guild_id, day__gte=first_day)
+                      .values("priority", "created", "resolved"))
+        resolution_times = ticket_resolution_times.get((ctx.guild_id, days), {})
+
+        this_week = HelperWeeklyStats.week_of(today)
+        last_week = this_week - timedelta(weeks=1)
+        helpers = await (HelperWeeklyStats
+                         .filter(guild_id=ctx.guild_id, week__in=[this_week, last_week], rank__lte=3)
+                         .order_by("rank", "helper_id")
+                         .values_list("week", "helper_id", "resolved"))
+
+        open_tickets = Ticket.filter(guild_id=ctx.guild_id,
+                                     status__in=[TicketStatus.created, TicketStatus.burning])
+        backlog = await open_tickets.count()
+        oldest = await open_tickets.order_by("created_at").first().values_list("created_at", flat=True)
+
+        def top(week) -> str:
+            lines = [f"<@{helper_id}> — **{resolved}**" for day, helper_id, resolved in helpers if day == week]
+            return "\n".join(lines) or "Пока никого"
+
+        embed = discord.Embed(
+            title=f"📊 Статистика за {days} дн.",
+            fields=[
+                discord.EmbedField(
+                    name="Обычные вопросы",
+                    value=self.summarize([row for row in rows if row["priority"] == TicketPriority.regular],
+                                         resolution_times.get(TicketPriority.regular)),
+                ),
+                discord.EmbedField(
+                    name="🌠 Приоритетные вопросы",
+                    value=self.summarize([row for row in rows if row["priority"] == TicketPriority.golden],
+                                         resolution_times.get(TicketPriority.golden)),
+                ),
+                discord.EmbedField(
+                    name="Ждут ответа",
+                    value=f"**{backlog}**" + (
+                        f", самый старый создан <t:{int(oldest.timestamp())}:R>" if oldest else ""
+                    ),
+                ),
+                discord.EmbedField(name="Лучшие помощники недели", value=top(this_week), inline=True),
+                discord.EmbedField(name="Прошлой недели", value=top(last_week), inline=True),
+            ],
+            color=0x4334eb,
+            footer=discord.EmbedFooter("Обновлено"),
+            timestamp=self.refreshed_at,
+        )
+        await ctx.respond(embed=embed, ephemeral=True)
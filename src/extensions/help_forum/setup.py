@@ -1,7 +1,9 @@
 import discord
-from .cogs import HelpCog, ReputationCog
+from .cogs import HelpCog, ReputationCog, TicketSweeperCog, StatsCog
 
 
 def setup(bot: discord.Bot):
     bot.add_cog(HelpCog(bot))
-    bot.add_cog(ReputationCog())
\ No newline at end of file
+    bot.add_cog(ReputationCog())
+    bot.add_cog(TicketSweeperCog(bot))
+    bot.add_cog(StatsCog(bot))
\ No newline at end of file
@@ -1,77 +1,214 @@
+import time
 import discord
-from settings import BOT_MESSAGE_CHANNEL_ID, HELP_FORUM_ID, BOOSTY_EMOJI, WELCOME_ROLE_ID
-from utils import role_to_boosty_level
-from database import User
+from typing import Optional
+from datetime import datetime, timedelta
+from discord.ext import tasks
+from settings import (WELCOME_BATCH_SIZE, USER_RETENTION_DAYS, USER_PURGE_INTERVAL_HOURS,
+                      USER_SYNC_INTERVAL_HOURS)
+from database import User, LedgerEventKind, get_guild_config, guild_configs, boosty_index
 from common import CogWithBot
+from outbox import MessagePriority
+from ledger import ledger
+from supervisor import supervisor, RestartPolicy
+from .pipeline import JoinPipeline
 
 
 class BoostyCog(CogWithBot):
+    def __init__(self, bot: discord.Bot, *args, **kwargs):
+        super().__init__(bot, *args, **kwargs)
+        self.on_ready_fired = False
+
+    async def rebuild_index(self, guild: discord.Guild):
+        if guild.chunked:
+            members = [(member.id, [role.id for role in member.roles]) for member in guild.members]
+        else:
+            # Без кеша участников запрашиваем их постранично и оставляем только подписчиков
+            members = []
+            async for member in guild.fetch_members(limit=None):
+                role_ids = [role.id for role in member.roles]
+                if boosty_index.tier_for_roles(role_ids):
+                    members.append((member.id, role_ids))
+
+        counts = boosty_index.rebuild(guild.id, members)
+        summary = ", ".join(f"level {tier}: {count}" for tier, count in counts.items())
+        print(f"Boosty subscribers on '{guild.name}': {summary or 'no Boosty roles configured'}")
+
     @discord.Cog.listener()
-    async def on_member_update(self, before: discord.Member, after: discord.Member):
-        changed = set(after.roles) - set(before.roles)
-        if len(changed) == 0:
+    async def on_ready(self):
+        if self.on_ready_fired:
             return
-        
-        role = changed.pop()
-        boostyLevel = role_to_boosty_level(role)
-        if boostyLevel == 0:
+        self.on_ready_fired = True
+
+        for guild in self.bot.guilds:
+            if guild.id in guild_configs:
+                await self.rebuild_index(guild)
+
+    @discord.Cog.listener()
+    async def on_guild_settings_update(self, guild: discord.Guild):
+        await self.rebuild_index(guild)
+
+    @discord.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        self.update_member(after, before)
+
+    @discord.Cog.listener()
+    async def on_uncached_member_update(self, member: discord.Member):
+        self.update_member(member)
+
+    def update_member(self, member: discord.Member, before: Optional[discord.Member] = None):
+        if member.guild.id not in guild_configs:
             return
-        
-        self.bot.dispatch("new_boosty_user", after, boostyLevel)
+
+        oldLevel, boostyLevel = boosty_index.update(
+            member.guild.id, member.id, [role.id for role in member.roles]
+        )
+        if oldLevel is None:
+            # До пересчёта индекса (при запуске, после `/guild setup`) прежний уровень
+            # известен только из кеша участников, без него поздравление не отправляем
+            if before is None:
+                return
+            oldLevel = boosty_index.tier_for_roles(role.id for role in before.roles)
+        if boostyLevel > oldLevel:
+            self.bot.dispatch("new_boosty_user", member, boostyLevel)
+
+    @discord.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        boosty_index.remove(payload.guild_id, payload.user.id)
 
     @discord.Cog.listener(name="on_new_boosty_user")
     async def thank_new_subscriber(self, user: discord.Member, level: int):
-        channel = self.bot.get_channel(BOT_MESSAGE_CHANNEL_ID)
+        config = get_guild_config(user.guild.id)
         thanksEmbed = discord.Embed(
-            title=f"{BOOSTY_EMOJI} {user.display_name} поддержал автора!",
+            title=f"{config.boosty_emoji} {user.display_name} поддержал автора!",
             description=(
                 f"❤️ Спасибо большое за активацию подписки **{level}** уровня\n\n"
 
                 "Теперь ты можешь:\n"
-                f"1. Создавать приоритетные вопросы в <#{HELP_FORUM_ID}>"
+                f"1. Создавать приоритетные вопросы в <#{config.help_forum_id}>"
             ),
             color=0xf15f2c,
             thumbnail=user.display_avatar.url
         )
 
-        await channel.send(
-            user.mention,
-            embed=thanksEmbed
-        )
+        self.bot.outbox.send(config.bot_message_channel_id, user.mention, embed=thanksEmbed,
+                             priority=MessagePriority.normal)
 
 
 class WelcomeCog(CogWithBot):
+    def __init__(self, bot: discord.Bot, *args, **kwargs):
+        super().__init__(bot, *args, **kwargs)
+        self.pipeline = JoinPipeline(announce=self.announce_member)
+        supervisor.adopt("users: purge", self.purge, restart=RestartPolicy.on_failure)
+        supervisor.adopt("users: sync", self.sync_members, restart=RestartPolicy.on_failure)
+
+    @staticmethod
+    def merge_welcomes(payloads: list[tuple[discord.Member, discord.Colour]]):
+        "Объединяет ожидающие отправки приветствия в сообщения по `WELCOME_BATCH_SIZE` участников"
+        config = get_guild_config(payloads[0][0].guild.id)
+        messages = []
+        for start in range(0, len(payloads), WELCOME_BATCH_SIZE):
+            batch = payloads[start:start + WELCOME_BATCH_SIZE]
+            names = "\n".join(f"- **{member.display_name}**" for member, _ in batch)
+            welcomeEmbed = discord.Embed(
+                color=batch[0][1],
+                title="У нас пополнение!",
+                description=(
+                    f"Встречайте новых участников:\n{names}\n"
+                    "Мы очень рады вас видеть 💙\n\n"
+
+                    f"Задать вопрос по курсам пожно в <#{config.help_forum_id}>"
+                )
+            )
+            mentions = " ".join(member.mention for member, _ in batch)
+            messages.append((mentions, welcomeEmbed))
+        return messages
+
     @discord.Cog.listener()
     async def on_member_join(self, member: discord.Member):
-        await User.get_or_create(id=member.id)
-        welcomeRole = member.guild.get_role(WELCOME_ROLE_ID)
-        if welcomeRole is None:
-            return print(
-                "Не смог выдать приветственную роль пользователю "
-                f"{member.display_name}. Роль не найдена"
-            )
+        if not get_guild_config(member.guild.id):
+            return
+        await self.pipeline.submit(member)
 
-        await member.add_roles(welcomeRole, reason="Новый участник сервера")
+    async def announce_member(self, member: discord.Member, colour: discord.Colour):
+        config = get_guild_config(member.guild.id)
         welcomeEmbed = discord.Embed(
             thumbnail=member.display_avatar.url,
-            color=welcomeRole.color,
+            color=colour,
             title="У нас пополнение!",
             description=(
                 f"Встречайте нового участника - **{member.display_name}**!\n"
                 "Мы очень рады тебя видеть 💙\n\n"
 
-                f"Задать вопрос по курсам пожно в <#{HELP_FORUM_ID}>"
+                f"Задать вопрос по курсам пожно в <#{config.help_forum_id}>"
             )
         )
 
-        channel = self.bot.get_channel(BOT_MESSAGE_CHANNEL_ID)
-        await channel.send(member.mention, embed=welcomeEmbed)
-    
+        self.bot.outbox.send(
+            config.bot_message_channel_id, member.mention,
+            embed=welcomeEmbed,
+            priority=MessagePriority.low,
+            group="welcome",
+            payload=(member, colour),
+            merge=self.merge_welcomes,
+        )
+
+    def cog_unload(self):
+        self.pipeline.close()
+        self.purge.cancel()
+        self.sync_members.cancel()
+
+    @tasks.loop(hours=USER_PURGE_INTERVAL_HOURS)
+    async def purge(self):
+        started_at = time.perf_counter()
+        purged = await User.purge_departed(datetime.now().astimezone() - timedelta(days=USER_RETENTION_DAYS))
+        if purged:
+            print(
+                f"Purged {purged} users who left more than {USER_RETENTION_DAYS} days ago "
+                f"in {time.perf_counter() - started_at:.2f}s"
+            )
+
+    @purge.before_loop
+    async def before_purge(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(hours=USER_SYNC_INTERVAL_HOURS)
+    async def sync_members(self):
+        "Добавляет недостающих участников и отмечает вышедших, которых не отметил `on_raw_member_remove`"
+        started_at = time.perf_counter()
+        guilds = [guild for guild in self.bot.guilds if guild.id in guild_configs]
+        added, stale_ids = await User.sync_with_members(
+            member.id for guild in guilds async for member in guild.fetch_members(limit=None)
+        )
+        print(
+            f"All missing users registered successfully! Added {added} users "
+            f"from {len(guilds)} guilds in {time.perf_counter() - started_at:.2f}s"
+        )
+        if stale_ids:
+            marked = await User.mark_left(stale_ids)
+            print(f"{marked} users are no longer on any server and were marked as left")
+
+    @sync_members.before_loop
+    async def before_sync_members(self):
+        await self.bot.wait_until_ready()
+
     @discord.Cog.listener()
     async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
-        user = await User.get_or_none(id=payload.user.id)
-        if user:
-            await user.delete()
+        if payload.guild_id not in guild_configs:
+            return
+        ledger.record(LedgerEventKind.member_left, payload.user.id, guild_id=payload.guild_id)
+
+        # Пользователи общие для всех серверов, поэтому отмечаем только ушедших отовсюду.
+        # Проверяем только кеш участников: без полного кеша сервера (`LOW_MEMORY_MODE`)
+        # членство неизвестно, и выход отметит `sync_members`.
+        # Данные удаляются через `USER_RETENTION_DAYS` дней в `purge`
+        for guild_id in guild_configs:
+            guild = self.bot.get_guild(guild_id)
+            if guild_id == payload.guild_id or guild is None:
+                continue
+            if not guild.chunked or guild.get_member(payload.user.id):
+                return
+
+        await User.mark_left((payload.user.id,))
 
 
 class OwnerNotificationCog(CogWithBot):
@@ -0,0 +1,152 @@
+import time
+import asyncio
+import discord
+
+from typing import Awaitable, Callable
+from database import User, get_guild_config
+from supervisor import supervisor, RestartPolicy
+from settings import (JOIN_QUEUE_SIZE, JOIN_UPSERT_BATCH_SIZE, JOIN_UPSERT_ATTEMPTS,
+                      JOIN_UPSERT_LINGER, JOIN_ROLE_CONCURRENCY)
+
+
+class StageStats:
+    "Время от попадания участника в очередь этапа до завершения его обработки"
+
+    def __init__(self):
+        self.processed = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def observe(self, entered_at: float):
+        elapsed = time.perf_counter() - entered_at
+        self.processed += 1
+        self.total_seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+
+    def as_dict(self) -> dict[str, float]:
+        return {
+            "processed": self.processed,
+            "avg_seconds": self.total_seconds / self.processed if self.processed else 0.0,
+            "max_seconds": self.max_seconds,
+        }
+
+
+class JoinPipeline:
+    """
+        Конвейер обработки новых участников: запись в базу пачками ->
+        выдача приветственной роли с ограничением параллельности -> приветствие.
+        У каждого этапа своя ограниченная очередь, поэтому при наплыве участников
+        ждут только обработчики `on_member_join`, а не весь бот
+    """
+
+    def __init__(self, announce: Callable[[discord.Member, discord.Colour], Awaitable[None]]):
+        self.announce = announce
+        self.upsert_queue: asyncio.Queue = asyncio.Queue(maxsize=JOIN_QUEUE_SIZE)
+        self.role_queue: asyncio.Queue = asyncio.Queue(maxsize=JOIN_QUEUE_SIZE)
+        self.announce_queue: asyncio.Queue = asyncio.Queue(maxsize=JOIN_QUEUE_SIZE)
+        self.stage_stats = {
+            "upsert": StageStats(),
+            "roles": StageStats(),
+            "announce": StageStats(),
+        }
+        self._workers: list[asyncio.Task] = []
+
+    def start(self):
+        if self._workers:
+            return
+        workers = [
+            ("join: upsert", self._upsert_worker),
+            *(("join: roles", self._role_worker) for _ in range(JOIN_ROLE_CONCURRENCY)),
+            ("join: announce", self._announce_worker),
+        ]
+        self._workers = [
+            supervisor.spawn(name, worker, restart=RestartPolicy.on_failure)
+            for name, worker in workers
+        ]
+
+    def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers.clear()
+
+    async def submit(self, member: discord.Member):
+        self.start()
+        await self.upsert_queue.put((member, time.perf_counter()))
+
+    async def _collect_batch(self) -> list[tuple[discord.Member, float]]:
+        batch = [await self.upsert_queue.get()]
+        deadline = time.perf_counter() + JOIN_UPSERT_LINGER
+        while len(batch) < JOIN_UPSERT_BATCH_SIZE:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.upsert_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _upsert(self, batch: list[tuple[discord.Member, float]]):
+        for attempt in range(1, JOIN_UPSERT_ATTEMPTS + 1):
+            try:
+                await User.register_missing({member.id for member, _ in batch})
+                return
+            except Exception as e:
+                print(f"Не смог записать {len(batch)} новых участников в базу "
+                      f"(попытка {attempt} из {JOIN_UPSERT_ATTEMPTS}): {e}")
+                if attempt < JOIN_UPSERT_ATTEMPTS:
+                    await asyncio.sleep(2 ** (attempt - 1))
+
+    async def _upsert_worker(self):
+        while True:
+            batch = await self._collect_batch()
+            # Роль и приветствие от записи в базу не зависят, поэтому пачка идёт дальше в любом случае.
+            # Незаписанного пользователя создаст первое действие, которому нужна его строка
+            # (`User.get_or_create`), остальных - периодическая `WelcomeCog.sync_members`
+            await self._upsert(batch)
+
+            for member, entered_at in batch:
+                self.stage_stats["upsert"].observe(entered_at)
+                await self.role_queue.put((member, time.perf_counter()))
+
+    async def _role_worker(self):
+        while True:
+            member, entered_at = await self.role_queue.get()
+            config = get_guild_config(member.guild.id)
+            welcomeRole = member.guild.get_role(config.welcome_role_id) if config else None
+            # Приветствие от роли не зависит: без неё участник получит его с цветом по умолчанию
+            if welcomeRole is None:
+                print(
+                    "Не смог выдать приветственную роль пользователю "
+                    f"{member.display_name}. Роль не найдена"
+                )
+            else:
+                try:
+                    await member.add_roles(welcomeRole, reason="Новый участник сервера")
+                except Exception as e:
+                    print(f"Не смог выдать приветственную роль пользователю {member.display_name}: {e}")
+
+            self.stage_stats["roles"].observe(entered_at)
+            colour = welcomeRole.color if welcomeRole else discord.Colour.blurple()
+            await self.announce_queue.put((member, colour, time.perf_counter()))
+
+    async def _announce_worker(self):
+        while True:
+            member, colour, entered_at = await self.announce_queue.get()
+            try:
+                await self.announce(member, colour)
+            except Exception as e:
+                print(f"Не смог поприветствовать пользователя {member.display_name}: {e}")
+                continue
+            self.stage_stats["announce"].observe(entered_at)
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        depths = {
+            "upsert": self.upsert_queue.qsize(),
+            "roles": self.role_queue.qsize(),
+            "announce": self.announce_queue.qsize(),
+        }
+        return {
+            stage: {"depth": depths[stage], **stats.as_dict()}
+            for stage, stats in self.stage_stats.items()
+        }
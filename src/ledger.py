@@ -0,0 +1,124 @@
+import asyncio
+
+from datetime import datetime
+from typing import NamedTuple, Optional
+from database import LedgerEvent, LedgerEventKind
+from metrics import Counter, Gauge, registry
+from supervisor import supervisor, RestartPolicy
+from settings import LEDGER_BATCH_SIZE, LEDGER_FLUSH_INTERVAL, LEDGER_QUEUE_SIZE, LEDGER_MAX_RETRY_DELAY
+
+ledger_events = registry.register(Counter(
+    "bot_ledger_events_total", "События журнала по результату записи", labels=("result",)))
+
+
+class PendingEvent(NamedTuple):
+    "Событие, ожидающее записи. Поля идут в порядке `LedgerEvent.COPY_COLUMNS`"
+    kind: LedgerEventKind
+    user_id: int
+    guild_id: Optional[int]
+    thread_id: Optional[int]
+    amount: Optional[int]
+    created_at: datetime
+
+
+class Ledger:
+    """
+        Журнал событий с отложенной записью. Обработчики только кладут событие
+        в очередь, а фоновый писатель сохраняет накопившиеся события пачками,
+        как только их набирается `batch_size` или раз в `flush_interval` секунд.
+        Пачка, которую не удалось записать, остаётся первой и повторяется с увеличивающейся
+        паузой, а новые события теряются, только когда очередь заполнена.
+        При остановке бота оставшиеся события дописываются в `close`
+    """
+
+    def __init__(self, batch_size: int = LEDGER_BATCH_SIZE,
+                 flush_interval: float = LEDGER_FLUSH_INTERVAL,
+                 max_depth: int = LEDGER_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue[PendingEvent] = asyncio.Queue(maxsize=max_depth)
+        # Пачка, взятая из очереди, но ещё не записанная
+        self._pending: list[PendingEvent] = []
+        self._failures_in_row = 0
+        self._batch_ready = asyncio.Event()
+        self._closed = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._writer: Optional[asyncio.Task] = None
+        self._closing = False
+
+    def record(self, kind: LedgerEventKind, user_id: int, *, guild_id: Optional[int] = None,
+               thread_id: Optional[int] = None, amount: Optional[int] = None) -> None:
+        "Ставит событие в очередь без ожидания. При переполненной очереди событие теряется"
+        self.start()
+        event = PendingEvent(kind, user_id, guild_id, thread_id, amount, datetime.now().astimezone())
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            ledger_events.inc(result="dropped")
+            return
+
+        if self.queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    def start(self):
+        if self._writer is None and not self._closing:
+            self._writer = supervisor.spawn("ledger: writer", self._run,
+                                            restart=RestartPolicy.on_failure)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            while not await self.flush() and not self._closing:
+                delay = min(2 ** self._failures_in_row, LEDGER_MAX_RETRY_DELAY)
+                try:
+                    await asyncio.wait_for(self._closed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending) + self.queue.qsize()
+
+    async def flush(self) -> bool:
+        "Записывает все события из очереди пачками по `batch_size`. Возвращает `False` при ошибке"
+        async with self._flush_lock:
+            while self._pending or not self.queue.empty():
+                if not self._pending:
+                    self._pending = [self.queue.get_nowait()
+                                     for _ in range(min(self.batch_size, self.queue.qsize()))]
+                try:
+                    await LedgerEvent.write_batch(self._pending)
+                except Exception as e:
+                    self._failures_in_row += 1
+                    ledger_events.inc(len(self._pending), result="retried")
+                    print(f"Не смог записать {len(self._pending)} событий журнала "
+                          f"(попытка {self._failures_in_row}): {e}")
+                    return False
+
+                ledger_events.inc(len(self._pending), result="written")
+                self._pending = []
+                self._failures_in_row = 0
+            return True
+
+    async def close(self):
+        "Останавливает писателя, дождавшись текущей записи, и дописывает оставшиеся события"
+        self._closing = True
+        self._closed.set()
+        if self._writer is not None:
+            self._batch_ready.set()
+            await self._writer
+            self._writer = None
+        if not await self.flush():
+            lost = self.depth
+            ledger_events.inc(lost, result="dropped")
+            print(f"{lost} событий журнала потеряно при остановке")
+
+
+ledger = Ledger()
+
+registry.register(Gauge(
+    "bot_ledger_queue_depth", "События журнала, ожидающие записи", lambda: ledger.depth))
@@ -1,21 +1,75 @@
+import time
+started_at = time.perf_counter()
+
 import os
+import signal
 import discord
 import asyncio
 
-from tortoise import Tortoise
-from database import User
+import metrics
+
+from tortoise import Tortoise, connections
+from database import ensure_schema, warm_caches, user_stats_cache, ticket_cache
+from outbox import Outbox
+from ledger import ledger
+from supervisor import supervisor
+from throttle import install_throttling
+from runtime import StartupTimer, new_event_loop, install_fast_json
+from scheduler import Scheduler
+from db_pool import get_db_config, prewarm_pool
+from members import member_cache, install_member_hooks, report_memory_saving
+
+from settings import (DEBUG, BOT_MAIN_GUILD, BOT_SHARDED, BOT_SHARD_COUNT,
+                      LOW_MEMORY_MODE, METRICS_HOST, METRICS_PORT)
 
-from settings import DEBUG, BOT_MAIN_GUILD
+startup = StartupTimer(started_at)
+startup.phases["imports"] = time.perf_counter() - started_at
 
-loop = asyncio.new_event_loop()
+loop = new_event_loop()
 asyncio.set_event_loop(loop)
+json_codec = install_fast_json()
 intents = discord.Intents.default()
 intents.members = True
+if LOW_MEMORY_MODE:
+    # Участники не хранятся в памяти и подгружаются по запросу через `members.get_or_fetch_member`
+    member_options = {"member_cache_flags": discord.MemberCacheFlags.none(), "chunk_guilds_at_startup": False}
+else:
+    member_options = {}
 
-bot = discord.Bot(
+# AutoShardedBot распределяет серверы по нескольким подключениям к шлюзу
+bot = (discord.AutoShardedBot if BOT_SHARDED else discord.Bot)(
     loop=loop,
     intents=intents,
-    debug_guilds=([BOT_MAIN_GUILD] if DEBUG else None)
+    shard_count=BOT_SHARD_COUNT,
+    debug_guilds=([BOT_MAIN_GUILD] if DEBUG else None),
+    **member_options
+)
+bot.outbox = Outbox(bot)
+bot.scheduler = Scheduler()
+
+if LOW_MEMORY_MODE:
+    install_member_hooks(bot)
+
+metrics.instrument_bot(bot)
+# После метрик, чтобы отклонённые вызовы не попадали во время выполнения команд
+install_throttling(bot)
+metrics.instrument_stats(
+    "bot_cache", "Статистика кешей", "cache", ("size", "maxsize", "hits", "misses"),
+    lambda: {"user_stats": user_stats_cache.stats(), "tickets": ticket_cache.stats(),
+             "members": member_cache.stats()}
+)
+metrics.instrument_stats(
+    "bot_outbox", "Очередь исходящих сообщений", "channel",
+    ("depth", "sent", "coalesced", "dropped", "failed", "retried"), bot.outbox.stats
+)
+metrics.instrument_stats(
+    "bot_join_pipeline", "Конвейер новых участников", "stage",
+    ("depth", "processed", "avg_seconds", "max_seconds"),
+    lambda: bot.get_cog("WelcomeCog").pipeline.stats() if bot.get_cog("WelcomeCog") else {}
+)
+metrics.instrument_stats(
+    "bot_tasks", "Фоновые задачи", "task",
+    ("running", "runtime_seconds", "restarts", "failures"), supervisor.stats
 )
 
 
@@ -25,25 +79,75 @@ async def on_ready():
 
 
 @bot.listen("on_ready", once=True)
-async def register_all_users():
-    async for member in bot.get_guild(BOT_MAIN_GUILD).fetch_members(limit=None):
-        await User.get_or_create(id=member.id)
-    print("All missing users registered successfully!")
+async def report_startup():
+    startup.stop("gateway")
+    print(startup.summary())
+
+
+@bot.listen("on_ready", once=True)
+async def report_member_cache():
+    if LOW_MEMORY_MODE:
+        report_memory_saving(bot)
+
+
+@bot.listen("on_ready", once=True)
+async def start_scheduler():
+    await bot.scheduler.start()
+
+
+async def setup_database():
+    with startup.phase("database"):
+        await Tortoise.init(config=get_db_config())
+        metrics.instrument_database(type(connections.get("default")))
+        await prewarm_pool()
+    with startup.phase("schema"):
+        if not await ensure_schema():
+            print("Database schema is up to date, schema generation skipped")
+    with startup.phase("caches"):
+        await warm_caches()
+
+
+async def login():
+    with startup.phase("login"):
+        await bot.login(os.getenv("BOT_TOKEN"))
+        bot.owner_id = (await bot.application_info()).owner.id
+
+
+async def shutdown():
+    await bot.outbox.close()
+    await bot.close()
 
 
 async def main():
-    bot.load_extension(name="extensions.help_forum.setup")
-    bot.load_extension(name="extensions.code_review.setup")
-    bot.load_extension(name="extensions.reactive.setup")
-    await Tortoise.init(
-        db_url=(
-            f"asyncpg://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}"
-            f"@postgres-db:5432/{os.getenv('POSTGRES_DB')}"),
-        modules={"discord": ["database"]})
-    await Tortoise.generate_schemas(safe=True)
-    await bot.login(os.getenv("BOT_TOKEN"))
-    bot.owner_id = (await bot.application_info()).owner.id
-    await bot.connect(reconnect=True)
+    print(f"Event loop: {type(loop).__module__}, gateway JSON: {json_codec}")
+    supervisor.start_lag_monitor()
+    # Вход в Discord и подготовка базы не зависят друг от друга. Задачи успевают
+    # отправить первые запросы, и ответы приходят, пока загружаются расширения
+    database = supervisor.spawn("startup: database", setup_database)
+    session = supervisor.spawn("startup: login", login)
+    await asyncio.sleep(0)
+    with startup.phase("extensions"):
+        bot.load_extension(name="extensions.help_forum.setup")
+        bot.load_extension(name="extensions.code_review.setup")
+        bot.load_extension(name="extensions.reactive.setup")
+        bot.load_extension(name="extensions.guild_settings.setup")
+
+    # bot.close() завершает bot.connect, после чего журнал дописывает накопившиеся события.
+    # Исходящие сообщения отправляются раньше, пока соединение с Discord ещё открыто
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: asyncio.ensure_future(shutdown()))
+    try:
+        await asyncio.gather(database, session)
+        if METRICS_PORT:
+            await metrics.start_server(METRICS_HOST, METRICS_PORT)
+        startup.start("gateway")
+        await bot.connect(reconnect=True)
+    finally:
+        await bot.outbox.close()
+        await ledger.close()
+        await supervisor.shutdown()
+        await bot.close()
+        await Tortoise.close_connections()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+import tracemalloc
+import discord
+
+from datetime import datetime, timezone
+from typing import Optional
+from utils import LRUCache
+from settings import MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL
+
+# (guild_id, member_id) -> discord.Member. В режиме экономии памяти py-cord не хранит участников,
+# поэтому здесь лежат только те, кого бот недавно запрашивал
+member_cache = LRUCache(maxsize=MEMBER_CACHE_SIZE, ttl=MEMBER_CACHE_TTL)
+
+
+async def get_or_fetch_member(guild: discord.Guild, member_id: int) -> Optional[discord.Member]:
+    "Ищет участника в кеше py-cord, затем в `member_cache` и только потом запрашивает его у Discord"
+    member = guild.get_member(member_id) or member_cache.get((guild.id, member_id))
+    if member is not None:
+        return member
+
+    try:
+        member = await guild.fetch_member(member_id)
+    except discord.NotFound:
+        return None
+
+    member_cache.set((guild.id, member_id), member)
+    return member
+
+
+def install_member_hooks(bot: discord.Bot):
+    """
+        Без кеша участников py-cord отбрасывает GUILD_MEMBER_UPDATE, и `on_member_update`
+        не вызывается. Для таких участников событие разбирается здесь и отправляется
+        как `on_uncached_member_update(member)`. Заодно `member_cache` обновляется
+        при изменении участника и очищается при его выходе
+    """
+    state = bot._connection
+    parse_member_update = state.parsers["GUILD_MEMBER_UPDATE"]
+    parse_member_remove = state.parsers["GUILD_MEMBER_REMOVE"]
+
+    def parse_update(data):
+        guild = bot.get_guild(int(data["guild_id"]))
+        if guild is None or guild.get_member(int(data["user"]["id"])) is not None:
+            return parse_member_update(data)
+
+        member = discord.Member(data=data, guild=guild, state=state)
+        if member_cache.peek((guild.id, member.id)) is not None:
+            member_cache.set((guild.id, member.id), member)
+        bot.dispatch("uncached_member_update", member)
+
+    def parse_remove(data):
+        member_cache.pop((int(data["guild_id"]), int(data["user"]["id"])))
+        parse_member_remove(data)
+
+    state.parsers["GUILD_MEMBER_UPDATE"] = parse_update
+    state.parsers["GUILD_MEMBER_REMOVE"] = parse_remove
+
+
+def estimate_member_size(bot: discord.Bot, guild: discord.Guild, samples: int = 500) -> float:
+    "Средний размер участника вместе с пользователем в байтах, измеренный на синтетических данных"
+    now = datetime.now(timezone.utc).isoformat()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        members = [
+            discord.Member(data={
+                "user": {
+                    "id": str(10 ** 17 + i),
+                    "username": f"member{i}",
+                    "global_name": f"Member {i}",
+                    "discriminator": "0",
+                    "avatar": "0" * 32,
+                },
+                "roles": [],
+                "joined_at": now,
+                "nick": None,
+                "deaf": False,
+                "mute": False,
+            }, guild=guild, state=bot._connection)
+            for i in range(samples)
+        ]
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (after - before) / len(members)
+
+
+def report_memory_saving(bot: discord.Bot):
+    guilds = bot.guilds
+    if not guilds:
+        return
+
+    not_cached = sum(guild.member_count or 0 for guild in guilds)
+    saved = not_cached * estimate_member_size(bot, guilds[0])
+    print(
+        f"Low-memory mode: {not_cached} members of {len(guilds)} guilds are not cached, "
+        f"saving ~{saved / 2 ** 20:.1f} MB"
+    )
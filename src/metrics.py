@@ -0,0 +1,276 @@
+import math
+import time
+import discord
+
+from aiohttp import web
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ])
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """
+        Метрика, значение которой считается при каждом запросе функцией `collect`.
+        `collect` возвращает число или словарь {значения меток: число}
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, collect: Callable,
+                 labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = buckets
+        self._counts: dict[tuple, list[int]] = {}
+        self._sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def samples(self):
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                labels = _format_labels((*self.labels, "le"), (*key, _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, key)
+            yield f"{self.name}_sum{labels} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+listener_seconds = registry.register(Histogram(
+    "bot_listener_seconds", "Время выполнения обработчиков событий", labels=("event", "listener")))
+listener_errors = registry.register(Counter(
+    "bot_listener_errors_total", "Исключения в обработчиках событий", labels=("event", "listener")))
+command_seconds = registry.register(Histogram(
+    "bot_command_seconds", "Время выполнения команд приложения", labels=("command",)))
+command_errors = registry.register(Counter(
+    "bot_command_errors_total", "Ошибки команд приложения", labels=("command", "error")))
+interaction_seconds = registry.register(Histogram(
+    "bot_interaction_seconds", "Время обработки кнопок и модальных окон", labels=("component",)))
+interaction_errors = registry.register(Counter(
+    "bot_interaction_errors_total", "Исключения при обработке кнопок и модальных окон",
+    labels=("component",)))
+db_query_seconds = registry.register(Histogram(
+    "bot_db_query_seconds", "Время выполнения запросов Tortoise", labels=("operation",)))
+rest_seconds = registry.register(Histogram(
+    "bot_discord_rest_seconds", "Время запросов к REST API Discord", labels=("method", "route")))
+task_errors = registry.register(Counter(
+    "bot_background_task_errors_total", "Исключения в фоновых задачах", labels=("task",)))
+
+
+def track_interaction(component: str):
+    "Замеряет время обработки кнопки или модального окна и считает исключения"
+    def decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return await f(*args, **kwargs)
+            except Exception:
+                interaction_errors.inc(component=component)
+                raise
+            finally:
+                interaction_seconds.observe(time.perf_counter() - started_at, component=component)
+        return wrapper
+    return decorator
+
+
+def instrument_bot(bot: discord.Bot):
+    "Оборачивает запуск обработчиков событий, команды приложения и REST-запросы бота"
+    run_event = bot._run_event
+
+    async def timed_run_event(coro, event_name: str, *args, **kwargs):
+        listener = getattr(coro, "__qualname__", event_name)
+
+        async def timed(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return await coro(*args, **kwargs)
+            except Exception:
+                listener_errors.inc(event=event_name, listener=listener)
+                raise
+            finally:
+                listener_seconds.observe(time.perf_counter() - started_at,
+                                         event=event_name, listener=listener)
+
+        await run_event(timed, event_name, *args, **kwargs)
+
+    bot._run_event = timed_run_event
+
+    invoke_application_command = bot.invoke_application_command
+
+    async def timed_invoke(ctx: discord.ApplicationContext):
+        with command_seconds.time(command=ctx.command.qualified_name):
+            await invoke_application_command(ctx)
+
+    bot.invoke_application_command = timed_invoke
+
+    @bot.listen("on_application_command_error")
+    async def count_command_error(ctx: discord.ApplicationContext, error: Exception):
+        if isinstance(error, discord.ApplicationCommandInvokeError):
+            error = error.original
+        command_errors.inc(command=ctx.command.qualified_name, error=type(error).__name__)
+
+    request = bot.http.request
+
+    async def timed_request(route, **kwargs):
+        with rest_seconds.time(method=route.method, route=route.path):
+            return await request(route, **kwargs)
+
+    bot.http.request = timed_request
+
+    registry.register(Gauge(
+        "bot_gateway_latency_seconds", "Задержка между HEARTBEAT и HEARTBEAT_ACK",
+        lambda: bot.latency))
+
+    if isinstance(bot, discord.AutoShardedBot):
+        registry.register(Gauge(
+            "bot_shard_latency_seconds", "Задержка HEARTBEAT отдельных шардов",
+            lambda: {(shard_id,): latency for shard_id, latency in bot.latencies},
+            labels=("shard",)))
+
+
+def _timed_query(original, operation: str):
+    @wraps(original)
+    async def wrapper(*args, **kwargs):
+        with db_query_seconds.time(operation=operation):
+            return await original(*args, **kwargs)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_database(client_class: type):
+    "Замеряет время запросов всех подключений класса `client_class` и его транзакций"
+    for cls in (client_class, *client_class.__subclasses__()):
+        for operation in ("execute_query", "execute_query_dict", "execute_insert",
+                          "execute_many", "execute_script"):
+            original = getattr(cls, operation)
+            if not getattr(original, "__instrumented__", False):
+                setattr(cls, operation, _timed_query(original, operation))
+
+
+def instrument_stats(name: str, documentation: str, label: str,
+                     fields: Iterable[str], collect: Callable[[], dict]):
+    """
+        Регистрирует по датчику на каждое поле из `fields` словарей статистики,
+        которые возвращает `collect` в виде {значение метки `label`: {поле: число}}
+    """
+    for field in fields:
+        registry.register(Gauge(
+            f"{name}_{field}", f"{documentation}: {field}",
+            lambda field=field: {
+                (key,): stats[field] for key, stats in collect().items() if field in stats
+            },
+            labels=(label,),
+        ))
+
+
+async def start_server(host: str, port: int) -> Optional[web.AppRunner]:
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics are served on http://{host}:{port}/metrics")
+    return runner
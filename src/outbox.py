@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import itertools
+import discord
+
+from enum import IntEnum
+from typing import Any, Callable, NamedTuple, Optional
+from settings import (OUTBOX_FLUSH_WINDOW, OUTBOX_MAX_DEPTH, OUTBOX_MAX_ATTEMPTS,
+                      OUTBOX_MAX_RETRY_DELAY, OUTBOX_CLOSE_TIMEOUT)
+from supervisor import supervisor, RestartPolicy
+
+
+class MessagePriority(IntEnum):
+    high = 0
+    normal = 1
+    low = 2
+
+
+class OutboundMessage(NamedTuple):
+    priority: MessagePriority
+    seq: int
+    content: Optional[str]
+    embed: Optional[discord.Embed]
+    # Сообщения с одинаковой группой, ожидающие отправки, объединяются функцией `merge`
+    group: Optional[str]
+    payload: Any
+    merge: Optional[Callable[[list], list[tuple[Optional[str], Optional[discord.Embed]]]]]
+    # Неудачные попытки отправки, после `OUTBOX_MAX_ATTEMPTS` сообщение теряется
+    attempts: int = 0
+
+
+class ChannelStats:
+    def __init__(self):
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retried = 0
+
+
+class Outbox:
+    """
+        Очередь исходящих сообщений бота, отдельная для каждого канала.
+        Обработчики событий только ставят сообщение в очередь, а отправкой
+        занимается один воркер на канал: он ждёт `flush_window` секунд, чтобы
+        накопить сообщения, объединяет однотипные и отправляет остальные по приоритету.
+        Сообщения, которые не удалось отправить из-за сбоя Discord или сети,
+        возвращаются в очередь с растущей паузой
+    """
+
+    def __init__(self, bot: discord.Bot, flush_window: float = OUTBOX_FLUSH_WINDOW,
+                 max_depth: int = OUTBOX_MAX_DEPTH):
+        self.bot = bot
+        self.flush_window = flush_window
+        self.max_depth = max_depth
+        self._seq = itertools.count()
+        self._queues: dict[int, list[OutboundMessage]] = {}
+        self._wakeups: dict[int, asyncio.Event] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self._stats: dict[int, ChannelStats] = {}
+        # seq -> (канал, сообщение, таймер) для сообщений, ожидающих повторной отправки
+        self._retries: dict[int, tuple[int, OutboundMessage, asyncio.TimerHandle]] = {}
+        self._closing = False
+
+    def send(self, channel_id: int, content: Optional[str] = None, *,
+             embed: Optional[discord.Embed] = None,
+             priority: MessagePriority = MessagePriority.normal,
+             group: Optional[str] = None, payload: Any = None,
+             merge: Optional[Callable] = None) -> None:
+        self._push(channel_id, OutboundMessage(
+            priority, next(self._seq), content, embed, group, payload, merge
+        ))
+
+    def _push(self, channel_id: int, message: OutboundMessage) -> None:
+        queue = self._queues.setdefault(channel_id, [])
+        stats = self._stats.setdefault(channel_id, ChannelStats())
+        if len(queue) >= self.max_depth:
+            # Очередь полна: новое сообщение вытесняет самое новое из менее приоритетных
+            victim = max(queue)
+            stats.dropped += 1
+            if victim.priority <= message.priority:
+                return
+            queue.remove(victim)
+            heapq.heapify(queue)
+
+        heapq.heappush(queue, message)
+        self._wakeups.setdefault(channel_id, asyncio.Event()).set()
+
+        worker = self._workers.get(channel_id)
+        if worker is None or worker.done():
+            self._workers[channel_id] = supervisor.spawn(
+                f"outbox: {channel_id}", lambda: self._run(channel_id),
+                restart=RestartPolicy.on_failure,
+            )
+
+    def _pop_batch(self, channel_id: int) -> list[OutboundMessage]:
+        "Достаёт самое приоритетное сообщение вместе со всеми ожидающими сообщениями его группы"
+        queue = self._queues[channel_id]
+        first = heapq.heappop(queue)
+        if first.group is None:
+            return [first]
+
+        batch = [first] + [message for message in queue if message.group == first.group]
+        queue[:] = [message for message in queue if message.group != first.group]
+        heapq.heapify(queue)
+        batch.sort()
+        return batch
+
+    def _fail(self, channel_id: int, messages: list[OutboundMessage], error: Exception) -> None:
+        "Возвращает сообщения в очередь через `2 ** attempts` секунд, если повтор может помочь"
+        stats = self._stats[channel_id]
+        print(f"Не смог отправить {len(messages)} сообщений в канал {channel_id}: {error!r}")
+        # Ошибки запроса (нет доступа, канал удалён, сообщение некорректно) повтор не исправит
+        if isinstance(error, discord.HTTPException) and error.status < 500:
+            stats.failed += len(messages)
+            return
+
+        loop = asyncio.get_running_loop()
+        for message in messages:
+            attempts = message.attempts + 1
+            if self._closing or attempts >= OUTBOX_MAX_ATTEMPTS:
+                stats.failed += 1
+                continue
+            # Повтор отправляется как есть: объединение уже выполнено или не удалось
+            message = message._replace(seq=next(self._seq), group=None, payload=None,
+                                       merge=None, attempts=attempts)
+            handle = loop.call_later(min(2 ** attempts, OUTBOX_MAX_RETRY_DELAY),
+                                     self._requeue, channel_id, message)
+            self._retries[message.seq] = (channel_id, message, handle)
+            stats.retried += 1
+
+    def _requeue(self, channel_id: int, message: OutboundMessage) -> None:
+        self._retries.pop(message.seq, None)
+        self._push(channel_id, message)
+
+    async def _deliver(self, channel_id: int, batch: list[OutboundMessage]) -> None:
+        stats = self._stats[channel_id]
+        if len(batch) == 1 or batch[0].merge is None:
+            messages = batch
+        else:
+            parts = batch[0].merge([message.payload for message in batch])
+            stats.coalesced += len(batch) - len(parts)
+            messages = [batch[0]._replace(content=content, embed=embed) for content, embed in parts]
+
+        try:
+            # Канала может не быть в кеше, например сразу после переподключения
+            channel = self.bot.get_channel(channel_id) or await self.bot.fetch_channel(channel_id)
+        except Exception as e:
+            return self._fail(channel_id, messages, e)
+
+        for message in messages:
+            try:
+                await channel.send(message.content, embed=message.embed)
+                stats.sent += 1
+            except Exception as e:
+                self._fail(channel_id, [message], e)
+
+    async def _run(self, channel_id: int):
+        wakeup = self._wakeups[channel_id]
+        queue = self._queues[channel_id]
+        while True:
+            await wakeup.wait()
+            if not self._closing:
+                await asyncio.sleep(self.flush_window)
+            wakeup.clear()
+            while queue:
+                batch = self._pop_batch(channel_id)
+                try:
+                    await self._deliver(channel_id, batch)
+                except Exception as e:
+                    # Например, ошибка в `merge`: сообщения пачки повторяются по отдельности
+                    self._fail(channel_id, batch, e)
+            if self._closing:
+                return
+
+    def stats(self) -> dict[int, dict[str, int]]:
+        return {
+            channel_id: {
+                "depth": len(self._queues.get(channel_id, ())),
+                "sent": stats.sent,
+                "coalesced": stats.coalesced,
+                "dropped": stats.dropped,
+                "failed": stats.failed,
+                "retried": stats.retried,
+            }
+            for channel_id, stats in self._stats.items()
+        }
+
+    async def close(self, timeout: float = OUTBOX_CLOSE_TIMEOUT) -> None:
+        "Отправляет ожидающие сообщения без повторов не дольше `timeout` секунд и останавливает воркеры"
+        self._closing = True
+        for channel_id, message, handle in self._retries.values():
+            handle.cancel()
+            self._push(channel_id, message)
+        self._retries.clear()
+        for wakeup in self._wakeups.values():
+            wakeup.set()
+
+        workers = [worker for worker in self._workers.values() if not worker.done()]
+        if workers:
+            _, pending = await asyncio.wait(workers, timeout=timeout)
+            for worker in pending:
+                worker.cancel()
+        for channel_id, queue in self._queues.items():
+            if queue:
+                self._stats[channel_id].dropped += len(queue)
+                print(f"{len(queue)} сообщений в канал {channel_id} потеряно при остановке")
+                queue.clear()
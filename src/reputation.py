@@ -0,0 +1,68 @@
+"""
+    Пересчёт репутации помощников по истории вопросов.
+
+        python src/reputation.py          # только показать расхождения
+        python src/reputation.py --apply  # записать пересчитанные значения
+
+    Кеши запущенного бота скрипт не обновляет, поэтому при работающем боте
+    лучше использовать команду /reputation rebuild
+"""
+import asyncio
+import argparse
+
+from tortoise import Tortoise
+from database import User, ReputationDiff, LedgerEventKind
+from db_pool import get_db_config
+from ledger import ledger
+
+
+async def rebuild_reputation(apply: bool) -> list[ReputationDiff]:
+    diffs = await User.find_reputation_drift()
+    if apply and diffs:
+        await User.apply_reputation_rebuild([diff.user_id for diff in diffs])
+        for diff in diffs:
+            if diff.new_reputation != diff.old_reputation:
+                ledger.record(LedgerEventKind.rep_changed, diff.user_id,
+                              amount=diff.new_reputation - diff.old_reputation)
+            if diff.new_level > diff.old_level:
+                ledger.record(LedgerEventKind.level_up, diff.user_id, amount=diff.new_level)
+    return diffs
+
+
+def describe_drift(diffs: list[ReputationDiff], limit: int = 10) -> list[str]:
+    if not diffs:
+        return ["Репутация всех пользователей совпадает с историей вопросов"]
+
+    total = sum(diff.new_reputation - diff.old_reputation for diff in diffs)
+    levels = sum(1 for diff in diffs if diff.old_level != diff.new_level)
+    lines = [
+        f"Расхождения у **{len(diffs)}** пользователей, суммарно **{total:+}** репутации, "
+        f"уровень меняется у **{levels}**"
+    ]
+    biggest = sorted(diffs, key=lambda diff: abs(diff.new_reputation - diff.old_reputation), reverse=True)
+    lines.extend(
+        f"<@{diff.user_id}>: репутация {diff.old_reputation} → {diff.new_reputation}, "
+        f"уровень {diff.old_level} → {diff.new_level}, "
+        f"решено {diff.old_resolved} → {diff.new_resolved}"
+        for diff in biggest[:limit]
+    )
+    return lines
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Rebuild helper reputation from ticket history")
+    parser.add_argument("--apply", action="store_true", help="write the recomputed values")
+    args = parser.parse_args()
+
+    await Tortoise.init(config=get_db_config())
+    try:
+        diffs = await rebuild_reputation(args.apply)
+        print("\n".join(describe_drift(diffs, limit=50)))
+        print("Applied" if args.apply else "Dry run, nothing was written")
+    finally:
+        await ledger.close()
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
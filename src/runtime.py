@@ -0,0 +1,67 @@
+import time
+import asyncio
+import discord
+
+from contextlib import contextmanager
+from settings import FAST_RUNTIME
+
+# Необязательные зависимости профиля FAST_RUNTIME
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    if FAST_RUNTIME and uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def install_fast_json() -> str:
+    """
+        Подменяет JSON-кодек py-cord, которым разбираются события шлюза и ответы REST API.
+        msgspec py-cord подхватывает сам, а orjson подключается здесь. Возвращает имя кодека
+    """
+    if discord.utils.HAS_MSGSPEC:
+        return "msgspec"
+    if FAST_RUNTIME and orjson is not None:
+        discord.utils._from_json = orjson.loads
+        discord.utils._to_json = lambda obj: orjson.dumps(obj).decode("utf-8")
+        return "orjson"
+    return "json"
+
+
+class StartupTimer:
+    """
+        Длительность этапов запуска бота. Часть этапов идёт параллельно,
+        поэтому их сумма может быть больше общего времени запуска
+    """
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.phases: dict[str, float] = {}
+        self._running: dict[str, float] = {}
+
+    def start(self, name: str):
+        self._running[name] = time.perf_counter()
+
+    def stop(self, name: str):
+        self.phases[name] = time.perf_counter() - self._running.pop(name)
+
+    @contextmanager
+    def phase(self, name: str):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+        return f"Startup took {time.perf_counter() - self.started_at:.2f}s: {phases}"
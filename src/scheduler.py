@@ -0,0 +1,120 @@
+import time
+import heapq
+import asyncio
+
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from database import ScheduledJob
+from supervisor import supervisor, RestartPolicy
+from settings import SCHEDULER_MAX_RETRY_DELAY, SCHEDULER_MAX_ATTEMPTS
+
+
+class Scheduler:
+    """
+        Планировщик отложенных задач. Задачи хранятся в таблице `ScheduledJob`,
+        а в памяти лежит куча (время запуска, id), которую разбирает один цикл.
+        Задача удаляется из базы только после успешного выполнения, поэтому
+        прерванная перезапуском задача будет выполнена повторно (at-least-once),
+        поэтому обработчики должны быть идемпотентными. Задача, упавшая
+        `SCHEDULER_MAX_ATTEMPTS` раз подряд, удаляется
+    """
+
+    def __init__(self):
+        self._handlers: dict[str, Callable[..., Awaitable]] = {}
+        self._jobs: dict[int, ScheduledJob] = {}
+        self._heap: list[tuple[float, int]] = []
+        self._wakeup = asyncio.Event()
+        self._loop_task: asyncio.Task = None
+
+    def register(self, kind: str, handler: Callable[..., Awaitable]):
+        "Регистрирует обработчик задач типа `kind`. Он получит `payload` задачи как kwargs"
+        self._handlers[kind] = handler
+
+    def _push(self, job: ScheduledJob):
+        self._jobs[job.id] = job
+        heapq.heappush(self._heap, (job.run_at.timestamp(), job.id))
+        self._wakeup.set()
+
+    async def schedule(self, kind: str, run_at: datetime, **payload) -> ScheduledJob:
+        job = await ScheduledJob.create(kind=kind, run_at=run_at, payload=dict(sorted(payload.items())))
+        self._push(job)
+        return job
+
+    async def has_job(self, kind: str, **payload) -> bool:
+        # JSON сравнивается целиком: в Postgres как jsonb, в SQLite как текст,
+        # поэтому ключи упорядочиваются так же, как при `schedule`
+        return await ScheduledJob.filter(kind=kind, payload=dict(sorted(payload.items()))).exists()
+
+    async def cancel(self, job_id: int):
+        self._jobs.pop(job_id, None)
+        await ScheduledJob.filter(id=job_id).delete()
+
+    async def start(self):
+        """
+            Загружает все сохранённые задачи одним запросом, включая пропущенные, и запускает цикл.
+            Вызывается после загрузки расширений, поэтому задачи без обработчика
+            (например, от удалённого расширения) уже не выполнятся и удаляются
+        """
+        if self._loop_task is not None:
+            return
+
+        orphaned = await ScheduledJob.exclude(kind__in=list(self._handlers)).delete()
+        if orphaned:
+            print(f"Scheduler deleted {orphaned} jobs without a handler")
+        for job in await ScheduledJob.all().order_by("run_at"):
+            if job.id not in self._jobs:
+                self._push(job)
+
+        overdue = sum(1 for run_at, _ in self._heap if run_at <= time.time())
+        print(f"Scheduler started with {len(self._jobs)} jobs, {overdue} of them overdue")
+        self._loop_task = supervisor.spawn("scheduler", self._run, restart=RestartPolicy.on_failure)
+
+    def close(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+            self._loop_task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            run_at, job_id = self._heap[0]
+            delay = run_at - time.time()
+            if delay > 0:
+                # Просыпаемся раньше, если появилась более ранняя задача
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            job = self._jobs.pop(job_id, None)
+            if job is not None:
+                supervisor.spawn(f"scheduler: {job.kind}", lambda job=job: self._execute(job))
+
+    async def _execute(self, job: ScheduledJob):
+        handler = self._handlers.get(job.kind)
+        if handler is None:
+            print(f"Scheduler has no handler for job {job.kind} #{job.id}, deleting it")
+            return await job.delete()
+
+        try:
+            await handler(**job.payload)
+        except Exception as e:
+            job.attempts += 1
+            if job.attempts >= SCHEDULER_MAX_ATTEMPTS:
+                print(f"Job {job.kind} #{job.id} failed ({type(e).__name__}: {e}), "
+                      f"dropping it after {job.attempts} attempts")
+                return await job.delete()
+
+            delay = min(30 * 2 ** job.attempts, SCHEDULER_MAX_RETRY_DELAY)
+            job.run_at = datetime.now().astimezone() + timedelta(seconds=delay)
+            print(f"Job {job.kind} #{job.id} failed ({type(e).__name__}: {e}), retrying in {delay}s")
+            await job.save(update_fields=["attempts", "run_at"])
+            self._push(job)
+        else:
+            await job.delete()
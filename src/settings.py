@@ -1,9 +1,84 @@
 import os
 
 DEBUG = str(os.getenv("DEBUG")).lower() in ("1", "y", "yes", "t", "true")
+BOT_SHARDED = str(os.getenv("BOT_SHARDED")).lower() in ("1", "y", "yes", "t", "true")
+BOT_SHARD_COUNT = int(os.getenv("BOT_SHARD_COUNT", 0)) or None  # None - количество шардов выбирает Discord
+# Не держать в памяти всех участников серверов, а подгружать их по запросу
+LOW_MEMORY_MODE = str(os.getenv("LOW_MEMORY_MODE")).lower() in ("1", "y", "yes", "t", "true")
+# uvloop вместо стандартного цикла событий и orjson для JSON шлюза, если они установлены
+FAST_RUNTIME = str(os.getenv("FAST_RUNTIME")).lower() in ("1", "y", "yes", "t", "true")
+MEMBER_CACHE_SIZE = int(os.getenv("MEMBER_CACHE_SIZE", 1000))
+MEMBER_CACHE_TTL = float(os.getenv("MEMBER_CACHE_TTL", 600))
 INITIAL_MESSAGE_EMBED_IMAGE_URL = "https://i.imgur.com/iu2z5HR.png"
 BOOSTY_HELP_MULTIPLIER = 3
+MEMBER_SYNC_CHUNK_SIZE = 1000
+# Данные вышедших участников хранятся столько дней, и при возвращении репутация восстанавливается
+USER_RETENTION_DAYS = int(os.getenv("USER_RETENTION_DAYS", 30))
+USER_PURGE_INTERVAL_HOURS = 6
+USER_SYNC_INTERVAL_HOURS = 24
+USER_PURGE_CHUNK_SIZE = 1000
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10_000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 600))
+TICKET_CACHE_SIZE = int(os.getenv("TICKET_CACHE_SIZE", 5000))
+LEADERBOARD_PAGE_SIZE = 10
+OUTBOX_FLUSH_WINDOW = float(os.getenv("OUTBOX_FLUSH_WINDOW", 2))
+OUTBOX_MAX_DEPTH = 1000
+OUTBOX_MAX_ATTEMPTS = 5  # Паузы между попытками: 2, 4, 8, 16 секунд
+OUTBOX_MAX_RETRY_DELAY = 60
+OUTBOX_CLOSE_TIMEOUT = 10
+WELCOME_BATCH_SIZE = 20
+JOIN_QUEUE_SIZE = 1000
+JOIN_UPSERT_BATCH_SIZE = 100
+JOIN_UPSERT_LINGER = 0.5
+JOIN_UPSERT_ATTEMPTS = 4  # Паузы между попытками: 1, 2, 4 секунды
+JOIN_ROLE_CONCURRENCY = int(os.getenv("JOIN_ROLE_CONCURRENCY", 5))
+SCHEDULER_MAX_RETRY_DELAY = 3600
+# После стольких неудачных попыток задача удаляется: при паузах до часа это около 8 часов
+SCHEDULER_MAX_ATTEMPTS = 10
+TICKET_SWEEP_INTERVAL_MINUTES = 10
+TICKET_BURNING_AFTER_HOURS = float(os.getenv("TICKET_BURNING_AFTER_HOURS", 24))
+TICKET_ARCHIVE_AFTER_HOURS = float(os.getenv("TICKET_ARCHIVE_AFTER_HOURS", 24 * 7))
+TICKET_SWEEP_BATCH_SIZE = 200
+TICKET_SWEEP_EDIT_CONCURRENCY = 3
+TICKET_BACKFILL_BATCH_SIZE = 50
+DISCORD_MESSAGE_LIMIT = 2000
+REVIEW_EXPORT_BATCH_SIZE = 500
+STATS_REFRESH_MINUTES = 15
+STATS_WINDOWS = (1, 7, 30, 90)  # Периоды /stats в днях
+REPUTATION_REBUILD_CHUNK_SIZE = 500
+SIMILAR_TICKETS_LIMIT = 3
+# Слова из большего числа решённых вопросов ("ошибка", "код") не ищут похожие вопросы,
+# а только влияют на их порядок. Ограничивает число кандидатов, которые приходится сортировать
+SEARCH_COMMON_TERM_DOCS = 500
+# Частые слова меняются медленно, а их подсчёт читает все решённые вопросы
+SEARCH_LEXEMES_REFRESH_HOURS = 24
+LEDGER_BATCH_SIZE = 500
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", 5))
+LEDGER_QUEUE_SIZE = 50_000
+LEDGER_MAX_RETRY_DELAY = 60
+LEDGER_HISTORY_LIMIT = 25
+SUPERVISOR_MAX_RESTART_DELAY = 300
+SUPERVISOR_SHUTDOWN_TIMEOUT = 10
+LOOP_LAG_PROBE_INTERVAL = 0.5
+# Цикл событий, простоявший дольше, считается заблокированным, и в лог пишется его стек
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 1))
+# Пользователь может сделать THROTTLE_BURST запросов подряд, после чего
+# получает по одному новому раз в THROTTLE_PERIOD / THROTTLE_BURST секунд
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", 3))
+THROTTLE_PERIOD = float(os.getenv("THROTTLE_PERIOD", 10))
+THROTTLE_EVICT_INTERVAL = 60
+POSTGRES_HOST = os.getenv("POSTGRES_HOST", "postgres-db")
+POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", 5432))
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300))
+DB_POOL_MAX_QUERIES = int(os.getenv("DB_POOL_MAX_QUERIES", 50_000))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))  # 0 отключает метрики
 
+# Настройки основного сервера. Они попадают в таблицу `GuildSettings` при первом запуске,
+# а настройки остальных серверов задаются командой /guild setup
 if DEBUG:  # Сервер разработки
     HELP_FORUM_ID = 1268553428305580052
     BOT_MESSAGE_CHANNEL_ID = 1268553560044343326
@@ -0,0 +1,229 @@
+import sys
+import time
+import asyncio
+import threading
+import traceback
+
+from enum import Enum
+from discord.ext import tasks
+from typing import Awaitable, Callable, Optional
+from metrics import Counter, Histogram, registry, task_errors
+from settings import (SUPERVISOR_MAX_RESTART_DELAY, SUPERVISOR_SHUTDOWN_TIMEOUT,
+                      LOOP_LAG_PROBE_INTERVAL, LOOP_LAG_THRESHOLD)
+
+task_restarts = registry.register(Counter(
+    "bot_background_task_restarts_total", "Перезапуски фоновых задач", labels=("task",)))
+loop_lag_seconds = registry.register(Histogram(
+    "bot_event_loop_lag_seconds", "Задержка запуска callback'ов цикла событий",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)))
+loop_stalls = registry.register(Counter(
+    "bot_event_loop_stalls_total", "Блокировки цикла событий дольше LOOP_LAG_THRESHOLD"))
+
+
+class RestartPolicy(Enum):
+    never = "never"
+    on_failure = "on_failure"  # Перезапускать после исключения
+    always = "always"  # Перезапускать и после исключения, и после обычного завершения
+
+
+class TaskInfo:
+    def __init__(self, name: str, factory: Optional[Callable[[], Awaitable]], restart: RestartPolicy,
+                 loop: Optional[tasks.Loop] = None):
+        self.name = name
+        self.factory = factory
+        self.restart = restart
+        # Цикл `discord.ext.tasks`, задача которого перезапускается через `loop.start()`
+        self.loop = loop
+        self.started_at = time.monotonic()
+        self.restarts = 0
+        self.failures_in_row = 0
+        self.last_error: Optional[BaseException] = None
+
+    @property
+    def runtime(self) -> float:
+        return time.monotonic() - self.started_at
+
+
+class TaskSupervisor:
+    """
+        Реестр фоновых задач бота. Каждая задача запускается через `spawn` с именем
+        и политикой перезапуска, исключения считаются в метриках, а при остановке
+        бота все задачи отменяются в `shutdown`. Циклы `discord.ext.tasks.loop`
+        запускаются через `adopt` и перезапускаются по той же политике.
+        Заодно следит за задержкой цикла событий, см. `start_lag_monitor`
+    """
+
+    def __init__(self):
+        self._tasks: dict[asyncio.Task, TaskInfo] = {}
+        self._failures: dict[str, int] = {}
+        self._closing = False
+        self._loop_thread_id: Optional[int] = None
+        self._last_tick = 0.0
+        self._watchdog: Optional[threading.Thread] = None
+
+    def spawn(self, name: str, factory: Callable[[], Awaitable], *,
+              restart: RestartPolicy = RestartPolicy.never) -> asyncio.Task:
+        """
+            Запускает `factory()` в отдельной задаче. При перезапуске `factory` вызывается
+            снова, а возвращённая задача остаётся той же, поэтому её можно отменить в любой момент
+        """
+        info = TaskInfo(name, factory, restart)
+        task = asyncio.create_task(self._run(info), name=name)
+        self._track(task, info)
+        return task
+
+    def adopt(self, name: str, loop: tasks.Loop, *,
+              restart: RestartPolicy = RestartPolicy.never) -> asyncio.Task:
+        """
+            Запускает цикл `discord.ext.tasks`. Сам цикл перезапускается только после сетевых
+            ошибок, поэтому после любого другого исключения его перезапускает супервизор
+        """
+        task = loop.start()
+        self._track(task, TaskInfo(name, None, restart, loop))
+        return task
+
+    def _track(self, task: asyncio.Task, info: TaskInfo):
+        self._tasks[task] = info
+        task.add_done_callback(self._forget)
+
+    def _forget(self, task: asyncio.Task):
+        info = self._tasks.pop(task, None)
+        if info is None or task.cancelled():
+            return
+        # Исключения `spawn`-задач уже посчитаны в `_run`
+        error = task.exception()
+        if error is not None and info.factory is None:
+            self._report(info, error)
+
+        if info.loop is None or self._closing:
+            return
+        if error is not None and info.restart != RestartPolicy.never:
+            long_running = info.runtime > SUPERVISOR_MAX_RESTART_DELAY
+            info.failures_in_row = 1 if long_running else info.failures_in_row + 1
+        elif error is None and info.restart == RestartPolicy.always:
+            info.failures_in_row = 0
+        else:
+            return
+        self.spawn(f"{info.name}: restart", lambda: self._restart_loop(info))
+
+    def _restart_delay(self, failures_in_row: int) -> float:
+        return min(2 ** failures_in_row, SUPERVISOR_MAX_RESTART_DELAY) if failures_in_row else 0
+
+    async def _restart_loop(self, info: TaskInfo):
+        delay = self._restart_delay(info.failures_in_row)
+        print(f"Restarting background task {info.name!r} in {delay}s")
+        await asyncio.sleep(delay)
+        if self._closing or info.loop.is_running():
+            return
+        info.started_at = time.monotonic()
+        info.restarts += 1
+        task_restarts.inc(task=info.name)
+        self._track(info.loop.start(), info)
+
+    def _report(self, info: TaskInfo, error: BaseException):
+        info.last_error = error
+        self._failures[info.name] = self._failures.get(info.name, 0) + 1
+        task_errors.inc(task=info.name)
+        print(f"Background task {info.name!r} raised an exception after {info.runtime:.1f}s:")
+        traceback.print_exception(error)
+
+    async def _run(self, info: TaskInfo):
+        failures_in_row = 0
+        while True:
+            info.started_at = time.monotonic()
+            try:
+                await info.factory()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._report(info, e)
+                if info.restart == RestartPolicy.never or self._closing:
+                    raise
+                # Задача, проработавшая дольше максимальной паузы, падает не "в цикле"
+                failures_in_row = 1 if info.runtime > SUPERVISOR_MAX_RESTART_DELAY else failures_in_row + 1
+            else:
+                if info.restart != RestartPolicy.always or self._closing:
+                    return
+                failures_in_row = 0
+
+            delay = self._restart_delay(failures_in_row)
+            print(f"Restarting background task {info.name!r} in {delay}s")
+            await asyncio.sleep(delay)
+            info.restarts += 1
+            task_restarts.inc(task=info.name)
+
+    async def shutdown(self, timeout: float = SUPERVISOR_SHUTDOWN_TIMEOUT):
+        "Отменяет все зарегистрированные задачи и ждёт их завершения не дольше `timeout` секунд"
+        self._closing = True
+        tasks = [task for task in self._tasks if not task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                print(f"Background task {self._tasks[task].name!r} did not stop in {timeout}s")
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        "Для каждого имени: число запущенных задач, их наибольшее время работы, перезапуски и падения"
+        stats: dict[str, dict[str, float]] = {
+            name: {"running": 0, "runtime_seconds": 0.0, "restarts": 0, "failures": failures}
+            for name, failures in self._failures.items()
+        }
+        for task, info in self._tasks.items():
+            entry = stats.setdefault(
+                info.name, {"running": 0, "runtime_seconds": 0.0, "restarts": 0, "failures": 0}
+            )
+            entry["running"] += not task.done()
+            entry["runtime_seconds"] = max(entry["runtime_seconds"], info.runtime)
+            entry["restarts"] += info.restarts
+        return stats
+
+    def start_lag_monitor(self, interval: float = LOOP_LAG_PROBE_INTERVAL,
+                          threshold: float = LOOP_LAG_THRESHOLD):
+        """
+            Задача-зонд засыпает на `interval` секунд и замеряет, насколько позже она проснулась.
+            Поток-сторож проверяет, как давно зонд просыпался, и если цикл событий стоит дольше
+            `threshold` секунд, печатает стек главного потока - это и есть блокирующий код
+        """
+        if self._watchdog is not None:
+            return
+
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self.spawn("loop lag probe", lambda: self._probe(interval), restart=RestartPolicy.on_failure)
+        self._watchdog = threading.Thread(
+            target=self._watch, args=(asyncio.get_running_loop(), interval, threshold),
+            name="loop lag watchdog", daemon=True,
+        )
+        self._watchdog.start()
+
+    async def _probe(self, interval: float):
+        while True:
+            started_at = time.monotonic()
+            await asyncio.sleep(interval)
+            self._last_tick = time.monotonic()
+            loop_lag_seconds.observe(max(self._last_tick - started_at - interval, 0.0))
+
+    def _watch(self, loop: asyncio.AbstractEventLoop, interval: float, threshold: float):
+        reported_tick = None
+        while not self._closing and not loop.is_closed():
+            time.sleep(interval / 2)
+            tick = self._last_tick
+            stalled = time.monotonic() - tick - interval
+            if stalled < threshold or tick == reported_tick:
+                continue
+
+            # Одна блокировка - один отчёт, даже если она длится несколько проверок
+            reported_tick = tick
+            loop_stalls.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            task = asyncio.current_task(loop)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<стек недоступен>\n"
+            print(
+                f"Event loop is blocked for {stalled:.2f}s"
+                f"{f' in task {task.get_name()!r}' if task else ''}. Main thread stack:\n{stack}",
+                end="",
+            )
+
+
+supervisor = TaskSupervisor()
@@ -0,0 +1,96 @@
+import math
+import time
+import discord
+
+from typing import Callable, Union
+from metrics import Counter, Gauge, registry
+from settings import THROTTLE_BURST, THROTTLE_PERIOD, THROTTLE_EVICT_INTERVAL
+
+throttled_requests = registry.register(Counter(
+    "bot_throttled_requests_total", "Отклонённые из-за частых запросов взаимодействия",
+    labels=("throttle",)))
+
+throttles: dict[str, "Throttle"] = {}
+
+registry.register(Gauge(
+    "bot_throttle_buckets", "Пользователи с неполной корзиной токенов",
+    lambda: {(name,): len(throttle._buckets) for name, throttle in throttles.items()},
+    labels=("throttle",)))
+
+
+class Throttle:
+    """
+        Ограничение частоты запросов одного пользователя (token bucket): у каждого
+        пользователя корзина на `burst` токенов, которая заполняется заново за `per` секунд.
+        Корзины хранятся в памяти, а раз в `THROTTLE_EVICT_INTERVAL` секунд из них
+        удаляются полные - такой пользователь неотличим от нового
+    """
+
+    def __init__(self, name: str, burst: int = THROTTLE_BURST, per: float = THROTTLE_PERIOD):
+        self.name = name
+        self.burst = burst
+        self.rate = burst / per
+        self._buckets: dict[int, tuple[float, float]] = {}  # user_id -> (токены, время обновления)
+        self._evicted_at = time.monotonic()
+        throttles[name] = self
+
+    def acquire(self, user_id: int) -> float:
+        "Забирает токен и возвращает 0, а если токенов нет - через сколько секунд появится следующий"
+        now = time.monotonic()
+        if now - self._evicted_at >= THROTTLE_EVICT_INTERVAL:
+            self.evict_idle(now)
+
+        tokens, updated_at = self._buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        if tokens < 1:
+            self._buckets[user_id] = (tokens, now)
+            throttled_requests.inc(throttle=self.name)
+            return (1 - tokens) / self.rate
+
+        self._buckets[user_id] = (tokens - 1, now)
+        return 0.0
+
+    def evict_idle(self, now: float):
+        refill_seconds = self.burst / self.rate
+        self._buckets = {
+            user_id: bucket for user_id, bucket in self._buckets.items()
+            if now - bucket[1] < refill_seconds
+        }
+        self._evicted_at = now
+
+
+async def allow_interaction(throttle: Throttle, interaction: discord.Interaction) -> bool:
+    "Отвечает скрытым сообщением и возвращает False, если пользователь превысил лимит"
+    retry_after = throttle.acquire(interaction.user.id)
+    if not retry_after:
+        return True
+
+    await interaction.respond(
+        f"Слишком много запросов, попробуйте через {math.ceil(retry_after)} с", ephemeral=True
+    )
+    return False
+
+
+def throttled(throttle: Throttle):
+    """
+        Ограничивает частоту вызова команды приложения. Проверка выполняется
+        в `install_throttling` до проверок команды, которые могут обращаться к базе
+    """
+    def decorator(command: Union[discord.ApplicationCommand, Callable]):
+        callback = command.callback if isinstance(command, discord.ApplicationCommand) else command
+        callback.__throttle__ = throttle
+        return command
+    return decorator
+
+
+def install_throttling(bot: discord.Bot):
+    "Отклоняет вызовы команд, помеченных `throttled`, до запуска команды"
+    invoke_application_command = bot.invoke_application_command
+
+    async def throttled_invoke(ctx: discord.ApplicationContext):
+        throttle = getattr(ctx.command.callback, "__throttle__", None)
+        if throttle is not None and not await allow_interaction(throttle, ctx.interaction):
+            return
+        await invoke_application_command(ctx)
+
+    bot.invoke_application_command = throttled_invoke
@@ -1,22 +1,16 @@
+import re
+import math
+import time
+import heapq
 import discord
-from settings import BOOSTY_LEVEL1_ROLE, BOOSTY_LEVEL2_ROLE, BOOSTY_LEVEL3_ROLE, BOOSTY_LEVEL4_ROLE
+from settings import DISCORD_MESSAGE_LIMIT, SEARCH_COMMON_TERM_DOCS
+from collections import OrderedDict
 from functools import wraps
+from typing import Any, Hashable, Iterable, Optional
 from tortoise import Model
 from tortoise.transactions import in_transaction
 
 
-def log_task_exceptions(f):
-    async def wrapper(*args, **kwargs):
-        try:
-            return await f(*args, **kwargs)
-        except Exception as e:
-            print("Asyncio task raised an exception:")
-            print(e)
-            print(type(e))
-            raise e
-    return wrapper
-
-
 def save_model_after(f):
     "Сохраняет модель после изменения её внутренних параметров внутри транзакции"
     @wraps(f)
@@ -28,20 +22,247 @@ def save_model_after(f):
     return wrapper
 
 
-def role_to_boosty_level(role: discord.Role) -> int:
-    if role.id == BOOSTY_LEVEL4_ROLE:
-        return 4
-    if role.id == BOOSTY_LEVEL3_ROLE:
-        return 3
-    if role.id == BOOSTY_LEVEL2_ROLE:
-        return 2
-    if role.id == BOOSTY_LEVEL1_ROLE:
-        return 1
-    return 0
+class LRUCache:
+    """
+        Ограниченный по размеру LRU-кеш с необязательным временем жизни записей.
+        Считает попадания и промахи в `hits` и `misses`
+    """
+
+    def __init__(self, maxsize: int, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[Any, Optional[float]]] = OrderedDict()
+
+    def _lookup(self, key: Hashable):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key: Hashable, default=None):
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return entry[0]
+
+    def peek(self, key: Hashable, default=None):
+        "Возвращает значение, не трогая счётчики и порядок вытеснения"
+        entry = self._lookup(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: Hashable, value) -> None:
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def split_message(lines: Iterable[str], limit: int = DISCORD_MESSAGE_LIMIT) -> list[str]:
+    "Собирает строки в сообщения не длиннее `limit` символов. Слишком длинная строка режется на части"
+    messages = []
+    current = ""
+    for line in lines:
+        while len(line) > limit:
+            if current:
+                messages.append(current)
+                current = ""
+            messages.append(line[:limit])
+            line = line[limit:]
+
+        if current and len(current) + 1 + len(line) > limit:
+            messages.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+
+    if current:
+        messages.append(current)
+    return messages
+
+
+def format_duration(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days} д {hours} ч"
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    return f"{minutes} мин"
+
+
+class BoostyIndex:
+    """
+        Уровни подписки Boosty участников всех серверов.
+        Карта роль -> уровень строится из настроек серверов, уровни участников
+        пересчитываются целиком при запуске и затем обновляются по изменениям ролей.
+        Хранятся только подписчики, поэтому у остальных участников уровень 0
+    """
+
+    def __init__(self):
+        self._role_tiers: dict[int, int] = {}
+        self._guild_roles: dict[int, dict[int, int]] = {}
+        # Серверы, для которых уже выполнен полный пересчёт
+        self._ready_guilds: set[int] = set()
+        self._tiers: dict[tuple[int, int], int] = {}  # (guild_id, member_id) -> уровень
+
+    def set_guild_roles(self, guild_id: int, boosty_roles: Iterable[Optional[int]]) -> None:
+        "`boosty_roles` - id ролей Boosty сервера по возрастанию уровня (`GuildConfig.boosty_roles`)"
+        # Уровни участников посчитаны по старой карте и будут пересчитаны через `rebuild`
+        self._ready_guilds.discard(guild_id)
+        for role_id in self._guild_roles.pop(guild_id, {}):
+            self._role_tiers.pop(role_id, None)
+
+        roles = {role_id: tier for tier, role_id in enumerate(boosty_roles, start=1) if role_id}
+        self._role_tiers.update(roles)
+        self._guild_roles[guild_id] = roles
+
+    def tier_for_roles(self, role_ids: Iterable[int]) -> int:
+        return max((self._role_tiers.get(role_id, 0) for role_id in role_ids), default=0)
+
+    def lookup(self, guild_id: int, member_id: int) -> Optional[int]:
+        "Уровень участника по индексу или `None`, если сервер ещё не пересчитан"
+        if guild_id not in self._ready_guilds:
+            return None
+        return self._tiers.get((guild_id, member_id), 0)
+
+    def get(self, member: discord.Member) -> int:
+        tier = self.lookup(member.guild.id, member.id)
+        if tier is None:
+            return self.tier_for_roles(role.id for role in member.roles)
+        return tier
+
+    def update(self, guild_id: int, member_id: int, role_ids: Iterable[int]) -> tuple[Optional[int], int]:
+        """
+            Пересчитывает уровень участника по его ролям. Возвращает (старый уровень, новый уровень),
+            старый уровень - `None`, если сервер ещё не пересчитан и индекс его не знает
+        """
+        key = (guild_id, member_id)
+        old_tier = self.lookup(guild_id, member_id)
+        new_tier = self.tier_for_roles(role_ids)
+        if new_tier:
+            self._tiers[key] = new_tier
+        else:
+            self._tiers.pop(key, None)
+        return old_tier, new_tier
+
+    def remove(self, guild_id: int, member_id: int) -> None:
+        self._tiers.pop((guild_id, member_id), None)
+
+    def rebuild(self, guild_id: int, members: Iterable[tuple[int, Iterable[int]]]) -> dict[int, int]:
+        "Пересчитывает уровни всех участников сервера по парам (id, id ролей)"
+        self._tiers = {key: tier for key, tier in self._tiers.items() if key[0] != guild_id}
+        for member_id, role_ids in members:
+            self.update(guild_id, member_id, role_ids)
+        self._ready_guilds.add(guild_id)
+        return self.counts(guild_id)
+
+    def counts(self, guild_id: int) -> dict[int, int]:
+        "Количество подписчиков сервера на каждом уровне"
+        counts = dict.fromkeys(sorted(self._guild_roles.get(guild_id, {}).values()), 0)
+        for (member_guild_id, _), tier in self._tiers.items():
+            if member_guild_id == guild_id:
+                counts[tier] = counts.get(tier, 0) + 1
+        return counts
+
+
+_WORD_RE = re.compile(r"[^\W_]{3,}")
+
+
+def tokenize(text: Optional[str]) -> list[str]:
+    "Слова текста в нижнем регистре без повторов. Числа и слова короче трёх букв пропускаются"
+    words = dict.fromkeys(word for word in _WORD_RE.findall((text or "").lower()) if not word.isdigit())
+    return list(words)
+
+
+class TicketSearchIndex:
+    """
+        Обратный индекс решённых вопросов для баз без полнотекстового поиска.
+        Основа слова - его первые `STEM_LENGTH` букв, поэтому разные формы одного
+        слова обычно совпадают. Слова из названия весят больше слов из решения,
+        как веса A и B у `ts_rank` в Postgres
+    """
+    STEM_LENGTH = 6
+    TITLE_WEIGHT = 1.0
+    SOLUTION_WEIGHT = 0.4
+
+    def __init__(self):
+        self._postings: dict[tuple[int, str], dict[int, float]] = {}  # (guild_id, основа) -> {thread_id: вес}
+        self._titles: dict[int, tuple[int, str]] = {}  # thread_id -> (guild_id, название)
+        self._sizes: dict[int, int] = {}  # guild_id -> количество вопросов
+
+    @classmethod
+    def stems(cls, text: Optional[str]) -> set[str]:
+        return {word[:cls.STEM_LENGTH] for word in tokenize(text)}
+
+    def add(self, guild_id: int, thread_id: int, title: Optional[str],
+            solution_text: Optional[str]) -> None:
+        if thread_id in self._titles:
+            return
+        self._titles[thread_id] = (guild_id, title or "")
+        self._sizes[guild_id] = self._sizes.get(guild_id, 0) + 1
+
+        weights = dict.fromkeys(self.stems(solution_text), self.SOLUTION_WEIGHT)
+        weights.update(dict.fromkeys(self.stems(title), self.TITLE_WEIGHT))
+        for stem, weight in weights.items():
+            self._postings.setdefault((guild_id, stem), {})[thread_id] = weight
+
+    def search(self, guild_id: int, text: str, limit: int) -> list[tuple[int, str]]:
+        """
+            До `limit` вопросов сервера, в которых встречается хотя бы одно слово `text`,
+            по убыванию суммы весов совпавших слов, умноженных на их редкость (IDF).
+            Кандидатов дают только слова не более чем из `SEARCH_COMMON_TERM_DOCS` вопросов,
+            а частые лишь добавляют очки уже найденным. Возвращает пары (thread_id, название)
+        """
+        size = self._sizes.get(guild_id, 0)
+        # Сначала редкие слова, чтобы частые проверяли уже собранных кандидатов
+        postings_lists = sorted(
+            (postings for stem in self.stems(text)
+             if (postings := self._postings.get((guild_id, stem)))),
+            key=len,
+        )
+
+        scores: dict[int, float] = {}
+        for postings in postings_lists:
+            idf = math.log(1 + size / len(postings))
+            if len(postings) <= SEARCH_COMMON_TERM_DOCS:
+                for thread_id, weight in postings.items():
+                    scores[thread_id] = scores.get(thread_id, 0.0) + weight * idf
+            else:
+                for thread_id in scores:
+                    if thread_id in postings:
+                        scores[thread_id] += postings[thread_id] * idf
 
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(thread_id, self._titles[thread_id][1]) for thread_id, _ in best]
 
-def get_boosty_level(user: discord.Member) -> int:
-    for role in reversed(user.roles):
-        if (level := role_to_boosty_level(role)) > 0:
-            return level
-    return 0
\ No newline at end of file
+    def __len__(self) -> int:
+        return len(self._titles)